@@ -0,0 +1,5 @@
+"""Toronto KSI (Killed or Seriously Injured) traffic accident analysis.
+
+The notebook export ``ksi_analysis.py`` walks through the analysis step by
+step; the modules in this package hold the reusable pieces it is built from.
+"""
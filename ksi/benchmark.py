@@ -0,0 +1,167 @@
+"""Benchmark the pipeline on synthetic data of growing size.
+
+For every size a synthetic KSI_CLEAN.csv lookalike is written once (see
+``ksi.synthetic``) and the pipeline steps of the notebook are timed on it:
+parsing the CSV, cleaning, one hot encoding, the TruncatedSVD, training the
+random forest and scoring the test split. Every stage of every run is
+appended to a JSON lines file with the machine, library versions and git
+commit it ran on, so runs from different days and branches can be compared.
+``scaling_table`` shows where a stage stops scaling linearly. Nothing needs a
+network connection.
+
+    python -m ksi.benchmark --sizes 10000 100000 1000000
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import sklearn
+from sklearn.decomposition import TruncatedSVD
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import train_test_split
+
+from ksi.cleaning import encode_ordinals, group_categories
+from ksi.data import FLAG_COLUMNS, default_cache_dir, parse_ksi
+from ksi.encoding import ONE_HOT_COLUMNS, SparseOneHotEncoder
+from ksi.features import assemble_features
+from ksi.pipeline import FEATURES_TO_DROP, ORDINAL_FEATURES
+from ksi.profiling import Profiler
+from ksi.synthetic import write_ksi
+
+RSEED = 42
+
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+
+STAGES = ['load', 'clean', 'encode', 'svd', 'rf fit', 'rf predict']
+
+RESULTS_FILE = 'benchmarks.jsonl'
+
+
+def dataset_path(n_rows, data_dir=None):
+    return os.path.join(data_dir or os.path.join(default_cache_dir(), 'synthetic'), 'KSI_synthetic_%d.csv' % n_rows)
+
+
+def environment():
+    """What a benchmark ran on, recorded with every result."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'machine': platform.node(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+    }
+
+
+def benchmark_pipeline(path, profiler, n_components=34, n_estimators=100, max_depth=10, n_jobs=-1,
+                       random_state=RSEED):
+    """Run and time the pipeline stages on one CSV file, recording them in ``profiler``."""
+    with profiler.stage('load') as stage:
+        data = stage.output(parse_ksi(path))
+
+    with profiler.stage('clean', data) as stage:
+        data = stage.output(group_categories(encode_ordinals(data)))
+
+    with profiler.stage('encode', data) as stage:
+        onehot = SparseOneHotEncoder(ONE_HOT_COLUMNS).fit_transform(data)
+        X_sparse = stage.output(sp.hstack([sp.csr_matrix(data[FLAG_COLUMNS].to_numpy(dtype=np.float32)), onehot],
+                                          format='csr'))
+
+    with profiler.stage('svd', X_sparse) as stage:
+        svd = TruncatedSVD(n_components=n_components, n_iter=7, random_state=random_state).fit(X_sparse)
+        kept = [feature for feature in ORDINAL_FEATURES + list(range(n_components)) if feature not in FEATURES_TO_DROP]
+        X = stage.output(assemble_features(data, svd, X_sparse, kept).values)
+
+    train, test, train_labels, test_labels = train_test_split(X, data['INJURY'].to_numpy(), test_size=0.3,
+                                                              random_state=random_state)
+    forest = RandomForestClassifier(n_estimators=n_estimators, max_depth=max_depth, n_jobs=n_jobs,
+                                    random_state=random_state)
+    with profiler.stage('rf fit', train):
+        forest.fit(train, train_labels)
+
+    with profiler.stage('rf predict', test) as stage:
+        stage.output(forest.predict_proba(test))
+
+
+def run_benchmark(sizes=SIZES, data_dir=None, results_path=RESULTS_FILE, log=sys.stderr, **params):
+    """Benchmark every size, append the results to ``results_path`` and return them.
+
+    ``params`` go to ``benchmark_pipeline`` and are recorded with the results.
+    """
+    run = dict(environment(), started=datetime.datetime.now().isoformat(timespec='seconds'), **params)
+    records = []
+    for n_rows in sizes:
+        path = dataset_path(n_rows, data_dir)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write under a temporary name, so an interrupted run doesn't leave a short file behind
+            write_ksi(path + '.tmp', n_rows)
+            os.replace(path + '.tmp', path)
+
+        # tracemalloc would slow the stages down, so only times and RSS are recorded
+        profiler = Profiler(trace_allocations=False)
+        benchmark_pipeline(path, profiler, **params)
+        for stage in profiler.stages:
+            rows = stage.shape_in[0] if stage.shape_in else n_rows
+            record = dict(run, n_rows=n_rows, stage=stage.name, rows=rows, wall_seconds=stage.wall_seconds,
+                          cpu_seconds=stage.cpu_seconds, rows_per_second=rows / stage.wall_seconds,
+                          peak_rss=stage.peak_rss)
+            records.append(record)
+            if results_path:
+                with open(results_path, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+            if log:
+                print('%10d rows  %-10s %9.3fs  %12.0f rows/s' % (n_rows, stage.name, stage.wall_seconds,
+                                                                   record['rows_per_second']), file=log)
+    return pd.DataFrame(records)
+
+
+def load_results(path=RESULTS_FILE):
+    return pd.read_json(path, lines=True)
+
+
+def scaling_table(results, run=None, value='wall_seconds'):
+    """One row per size and one column per stage, plus how far each stage is from linear scaling.
+
+    The ``<stage> scaling`` columns are the time per row relative to the
+    smallest size: 1 is linear, 2 means a row costs twice as much as it did
+    on the smallest dataset. ``run`` picks a run by its ``started`` time;
+    the default is the latest run in ``results``.
+    """
+    results = results[results['started'] == (results['started'].max() if run is None else run)]
+    table = results.pivot_table(index='n_rows', columns='stage', values=value, aggfunc='median')
+    table = table[[stage for stage in STAGES if stage in table.columns]]
+    per_row = table.div(table.index.to_numpy(), axis=0)
+    return table.join(per_row.div(per_row.iloc[0]).add_suffix(' scaling'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='rows per dataset (default: %(default)s)')
+    parser.add_argument('--data-dir', help='where the synthetic datasets are kept (default: the KSI cache)')
+    parser.add_argument('--output', default=RESULTS_FILE, help='JSON lines file the results are appended to '
+                                                               '(default: %(default)s)')
+    parser.add_argument('--n-estimators', type=int, default=100, help='trees in the forest (default: %(default)s)')
+    parser.add_argument('--n-jobs', type=int, default=-1, help='cores used by the forest (default: all)')
+    args = parser.parse_args(argv)
+    results = run_benchmark(args.sizes, args.data_dir, args.output, n_estimators=args.n_estimators,
+                            n_jobs=args.n_jobs)
+    print(scaling_table(results).to_string(float_format='%.3f'))
+
+
+if __name__ == '__main__':
+    main()
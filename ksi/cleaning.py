@@ -0,0 +1,139 @@
+"""Table-driven cleaning of the raw KSI columns.
+
+Every recode the analysis applies is declared once in ``ORDINAL_MAPS`` (text
+levels to ordinal integers) or ``CATEGORY_GROUPS`` (small categories merged
+into bigger ones). Both are applied with a single lookup on the categorical
+codes of each column, so each column is scanned once no matter how many
+values its table lists.
+"""
+import numpy as np
+import pandas as pd
+
+
+def _levels(groups, **extra):
+    """Turn ``[[values for 0], [values for 1], ...]`` into a value -> level dict."""
+    mapping = {value: level for level, values in enumerate(groups) for value in values}
+    mapping.update(extra)
+    return mapping
+
+
+ORDINAL_MAPS = {
+    # Which type of road the drivers were on
+    'ROAD_CLASS': _levels([
+        ['Minor Arterial', 'Laneway', 'Local'],
+        ['Major Arterial', 'Major Arterial Ramp'],
+        ['Collector', 'Expressway', 'Expressway Ramp'],
+    ]),
+    # The weather conditions surrounding the accident
+    'VISIBILITY': _levels([
+        ['Clear', 'Other', ' '],
+        ['Rain', 'Strong wind', 'Fog, Mist, Smoke, Dust'],
+        ['Snow', 'Freezing Rain', 'Drifting Snow'],
+    ]),
+    # The amount of light present at the time of accident, Dusk and Dawn merged due to similar lighting
+    'LIGHT': _levels([
+        ['Daylight', 'Daylight, artificial', ' ', 'Other'],
+        ['Dusk', 'Dusk, artificial', 'Dawn', 'Dawn, artificial'],
+        ['Dark', 'Dark, artificial'],
+    ]),
+    # The road surface condition
+    'RDSFCOND': _levels([
+        ['Dry', ' '],
+        ['Wet', 'Other', 'Loose Sand or Gravel', 'Loose Snow'],
+        ['Slush', 'Ice', 'Packed Snow', 'Spilled liquid'],
+    ]),
+    # Age of the involved party in ten year bands, unknown ages filled with the average band
+    'INVAGE': _levels([
+        ['0 to 4', '5 to 9'],
+        ['10 to 14', '15 to 19'],
+        ['20 to 24', '25 to 29'],
+        ['30 to 34', '35 to 39'],
+        ['40 to 44', '45 to 49'],
+        ['50 to 54', '55 to 59'],
+        ['60 to 64', '65 to 69'],
+        ['70 to 74', '75 to 79'],
+        ['80 to 84', '85 to 89'],
+        ['90 to 94', 'Over 95'],
+    ], unknown=7),
+    # Our target class, with ' ' values set to no injury
+    'INJURY': _levels([
+        ['None', ' '],
+        ['Minimal', 'Minor'],
+        ['Major'],
+        ['Fatal'],
+    ]),
+}
+
+CATEGORY_GROUPS = {
+    # Vehicle classes grouped by weight class/vehicle type, leaving 'Other' as its own category
+    'VEHTYPE': {
+        ' ': 'NA',
+        **dict.fromkeys(['Municipal Transit Bus (TTC)', 'Truck - Open', 'Delivery Van', 'Street Car',
+                         'Truck - Dump', 'Truck-Tractor', 'Bus (Other) (Go Bus, Gray Coach)',
+                         'Truck (other)', 'Intercity Bus', 'Truck - Tank', 'School Bus',
+                         'Construction Equipment', 'Truck - Car Carrier', 'Fire Vehicle',
+                         'Other Emergency Vehicle'], 'Heavy Commercial'),
+        **dict.fromkeys(['Off Road - 2 Wheels', 'Moped'], 'Motorcycle'),
+        **dict.fromkeys(['Pick Up Truck', 'Passenger Van', 'Truck - Closed (Blazer, etc)',
+                         'Tow Truck'], 'Large Auto'),
+        **dict.fromkeys(['Taxi', 'Police Vehicle'], 'Automobile, Station Wagon'),
+    },
+    # The involvement of the person in the row of the database
+    'INVTYPE': {
+        **dict.fromkeys(['Moped Driver', 'Motorcycle Passenger'], 'Motorcycle Driver'),
+        **dict.fromkeys(['Wheelchair', 'In-Line Skater'], 'Pedestrian'),
+        **dict.fromkeys([' ', 'Other Property Owner', 'Driver - Not Hit', 'a', 'Runaway - No Driver',
+                         'Unknown - FTR', 'Pedestrian - Not Hit', 'Witness'], 'Other'),
+        'Trailer Owner': 'Vehicle Owner',
+    },
+    # Location coordinates of the accident
+    'LOCCOORD': dict.fromkeys([' ', 'Park, Private Property, Public Lane', 'Entrance Ramp Westbound'], 'Other'),
+    # The accident location
+    'ACCLOC': {' ': 'Other'},
+}
+
+
+def as_categorical(series):
+    """The column as a ``pd.Categorical``, without a copy when it already is one."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.array
+    return pd.Categorical(series)
+
+
+def encode_ordinal(series, mapping):
+    """Encode one column through its ordinal table, returning an int8 Series.
+
+    Raises ``ValueError`` when the column holds values the table doesn't know
+    about, rather than letting unencoded strings through to the models.
+    """
+    values = as_categorical(series)
+    lookup = np.array([mapping.get(category, -1) for category in values.categories] + [-1], dtype=np.int8)
+    # codes of -1 (missing values) pick the trailing -1 entry, same as unmapped values
+    encoded = lookup.take(values.codes)
+    if (encoded < 0).any():
+        raise ValueError('%s has values without an ordinal level: %r'
+                         % (series.name, list(pd.unique(series[encoded < 0]))))
+    return pd.Series(encoded, index=series.index, name=series.name)
+
+
+def encode_ordinals(data, columns=None, maps=ORDINAL_MAPS):
+    """Return a copy of ``data`` with ``columns`` (default: every mapped column) encoded."""
+    columns = list(maps) if columns is None else columns
+    return data.assign(**{column: encode_ordinal(data[column], maps[column]) for column in columns})
+
+
+def group_category(series, mapping):
+    """Merge categories of one column, leaving values missing from ``mapping`` as they are."""
+    values = as_categorical(series)
+    targets = [mapping.get(category, category) for category in values.categories]
+    merged = sorted(set(targets))
+    lookup = np.array([merged.index(target) for target in targets] + [-1], dtype=np.int32)
+    # codes of -1 (missing values) pick the trailing -1 entry and stay missing
+    grouped = pd.Categorical.from_codes(lookup.take(values.codes), merged)
+    return pd.Series(grouped, index=series.index, name=series.name).cat.remove_unused_categories()
+
+
+def group_categories(data, columns=None, groups=CATEGORY_GROUPS):
+    """Return a copy of ``data`` with small categories merged per ``groups``."""
+    columns = list(groups) if columns is None else columns
+    return data.assign(**{column: group_category(data[column], groups[column]) for column in columns})
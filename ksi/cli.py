@@ -0,0 +1,41 @@
+"""Command line entry point: ``python -m ksi <command> [options]``.
+
+    python -m ksi train --input KSI_CLEAN.csv
+    python -m ksi score ksi_model.npz KSI_2018.csv predictions.parquet
+    python -m ksi explore --by YEAR INJURY
+
+Every command is the ``main`` of its own module, and only the module of the
+command being run is imported. Nothing else gets loaded up front - no
+scikit-learn for ``score`` with a compiled model, no plotting or LightGBM
+unless a command actually uses them - so short commands start quickly.
+``python -m ksi <command> --help`` lists a command's options.
+"""
+import argparse
+import importlib
+import sys
+
+# command: (module with a main(argv) function, summary)
+COMMANDS = {
+    'train': ('ksi.train', 'train the pipeline and save it, plain and compiled'),
+    'score': ('ksi.score', 'score a CSV or Parquet file in chunks'),
+    'explore': ('ksi.cube', 'count accidents and people by any columns'),
+    'update': ('ksi.incremental', 'update a saved pipeline with new data'),
+    'serve': ('ksi.serving', 'serve predictions over HTTP'),
+    'benchmark': ('ksi.benchmark', 'time each pipeline step on synthetic data of growing size'),
+    'synthetic': ('ksi.synthetic', 'write a synthetic KSI dataset'),
+    'loadtest': ('ksi.loadtest', 'load test a prediction server'),
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    parser = argparse.ArgumentParser(
+        prog='python -m ksi', usage='%(prog)s [-h] command [options]', description=__doc__.splitlines()[0],
+        epilog='commands:\n' + '\n'.join('  %-10s %s' % (name, summary) for name, (_, summary) in COMMANDS.items()),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=COMMANDS, metavar='command')
+    args = parser.parse_args(argv[:1])
+    module = importlib.import_module(COMMANDS[args.command][0])
+    # Usage and error messages of the command read "python -m ksi <command>"
+    sys.argv[0] = 'python -m ksi %s' % args.command
+    return module.main(argv[1:])
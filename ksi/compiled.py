@@ -0,0 +1,163 @@
+"""Saved models that score raw rows without importing scikit-learn.
+
+Loading a joblib pipeline imports scikit-learn and SciPy, which takes longer
+than scoring a typical batch. ``compile_pipeline`` writes everything a fitted
+pipeline of ``ksi.pipeline`` needs to score into one ``.npz`` file of plain
+NumPy arrays: the one hot vocabulary, the SVD loadings of the kept
+components, the forest's node arrays (``ksi.forest.FlatForest``) and the
+decision weights. ``CompiledModel`` scores from it with NumPy and pandas
+alone. Every row has exactly one indicator per one hot column, so projecting
+it onto the components is a sum of loading rows picked by category code,
+added in the same order as the pipeline's sparse product, so the features
+are the pipeline's to the bit and the probabilities match up to floating
+point rounding. ``transform_records`` looks the same categories up in raw
+record dicts, without pandas, for the prediction server (``ksi.serving``),
+and adds up the same rows in the same order.
+
+    compile_pipeline(load_pipeline('ksi_model.joblib'), 'ksi_model.npz')
+    CompiledModel.load('ksi_model.npz').predict(raw_rows)
+"""
+import json
+import os
+
+import numpy as np
+
+from ksi.cleaning import CATEGORY_GROUPS, ORDINAL_MAPS, as_categorical, encode_ordinal, group_categories
+from ksi.data import FLAG_COLUMNS
+from ksi.forest import FlatForest
+
+COMPILED_MODEL_FILE = 'ksi_model.npz'
+
+
+def is_compiled(path):
+    """Whether ``path`` names a compiled model rather than a joblib pipeline."""
+    return os.path.splitext(str(path))[1].lower() == '.npz'
+
+
+def pipeline_arrays(pipeline):
+    """What a compiled model of the fitted ``pipeline`` is made of, as a dict of NumPy arrays."""
+    from ksi.encoding import OTHER
+    from ksi.pipeline import forest_of
+
+    preprocessor = pipeline.named_steps['preprocess']
+    encoder = preprocessor.encoder_
+    features = preprocessor.features_
+    components = [feature for feature in features if not isinstance(feature, str)]
+    model = pipeline.steps[-1][1]
+    forest = FlatForest(forest_of(pipeline))
+    class_weights = getattr(model, 'class_weights', None)
+    meta = {
+        'features': [feature if isinstance(feature, str) else int(feature) for feature in features],
+        'columns': list(encoder.columns),
+        'categories': [[str(category) for category in categories] for categories in encoder.categories_],
+        'other': [list(categories).index(OTHER) for categories in encoder.categories_],
+    }
+    return dict(meta=np.array(json.dumps(meta)),
+                loadings=np.ascontiguousarray(preprocessor.svd_.components_[components].T, dtype=np.float32),
+                class_weights=np.ones(len(forest.classes_)) if class_weights is None
+                else np.asarray(class_weights, dtype=np.float64),
+                **forest.to_arrays())
+
+
+def compile_pipeline(pipeline, path=COMPILED_MODEL_FILE):
+    """Save the fitted ``pipeline`` as a compiled model at ``path``."""
+    with open(path, 'wb') as f:
+        np.savez(f, **pipeline_arrays(pipeline))
+    return path
+
+
+class CompiledModel:
+    """A pipeline saved by ``compile_pipeline``, with the same ``predict_proba``, ``decide`` and ``predict``.
+
+    ``compiled`` picks the forest's tree walk, see ``ksi.forest.FlatForest``.
+    """
+
+    def __init__(self, arrays, compiled=None):
+        meta = json.loads(str(arrays['meta']))
+        self.features = meta['features']
+        self.columns = meta['columns']
+        self.categories = meta['categories']
+        self.other = meta['other']
+        self.loadings = np.asarray(arrays['loadings'])
+        self.class_weights = np.asarray(arrays['class_weights'])
+        self.forest = FlatForest.from_arrays(arrays, compiled=compiled)
+        self.classes_ = self.forest.classes_
+        # Loading rows are the flags first, then every column's categories in order
+        offsets = len(FLAG_COLUMNS) + np.cumsum([0] + [len(categories) for categories in self.categories])
+        self._rows = [{category: offset + i for i, category in enumerate(categories)}
+                      for offset, categories in zip(offsets, self.categories)]
+        self._other_rows = [offset + other for offset, other in zip(offsets, self.other)]
+        self._components = [position for position, feature in enumerate(self.features) if not isinstance(feature, str)]
+
+    @classmethod
+    def load(cls, path=COMPILED_MODEL_FILE, compiled=None):
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls({name: arrays[name] for name in arrays.files}, compiled=compiled)
+
+    @classmethod
+    def from_pipeline(cls, pipeline, compiled=None):
+        """The compiled model of a fitted pipeline, without saving it."""
+        return cls(pipeline_arrays(pipeline), compiled=compiled)
+
+    def _column_rows(self, series, position):
+        values = as_categorical(series)
+        rows, other = self._rows[position], self._other_rows[position]
+        # Unseen categories and missing values (code -1, the trailing entry) go to OTHER, as in SparseOneHotEncoder
+        lookup = np.array([rows.get(str(category), other) for category in values.categories] + [other],
+                          dtype=np.int64)
+        return lookup.take(values.codes)
+
+    def _assemble(self, ordinals, flags, column_rows):
+        values = np.empty((len(flags), len(self.features)), dtype=np.float32)
+        for position, ordinal in ordinals.items():
+            values[:, position] = ordinal
+        if self._components:
+            # Added up one input column at a time, in the order of the sparse product in ksi.features
+            projected = np.zeros((len(flags), self.loadings.shape[1]), dtype=np.float32)
+            for position in range(len(FLAG_COLUMNS)):
+                projected += flags[:, position, None] * self.loadings[position]
+            for rows in column_rows:
+                projected += self.loadings[rows]
+            values[:, self._components] = projected
+        return values
+
+    def transform(self, data):
+        """The model's float32 feature matrix for raw KSI rows."""
+        data = group_categories(data)
+        ordinals = {position: encode_ordinal(data[feature], ORDINAL_MAPS[feature]).to_numpy()
+                    if feature in ORDINAL_MAPS else data[feature].to_numpy()
+                    for position, feature in enumerate(self.features) if isinstance(feature, str)}
+        return self._assemble(ordinals, data[FLAG_COLUMNS].to_numpy(dtype=np.float32),
+                              [self._column_rows(data[column], position) for position, column in enumerate(self.columns)])
+
+    def transform_records(self, records):
+        """The same features as ``transform`` for a list of raw record dicts."""
+        ordinals = {}
+        for position, feature in enumerate(self.features):
+            if isinstance(feature, str):
+                values = [record[feature] for record in records]
+                if feature in ORDINAL_MAPS:
+                    try:
+                        values = [ORDINAL_MAPS[feature][value] for value in values]
+                    except KeyError as error:
+                        raise ValueError('%s has values without an ordinal level: %r' % (feature, error.args[0]))
+                ordinals[position] = values
+        flags = np.array([[record[flag] for flag in FLAG_COLUMNS] for record in records],
+                         dtype=np.float32).reshape(len(records), len(FLAG_COLUMNS))
+        column_rows = []
+        for column, rows, other in zip(self.columns, self._rows, self._other_rows):
+            groups = CATEGORY_GROUPS.get(column, {})
+            values = [groups.get(record.get(column), record.get(column)) for record in records]
+            column_rows.append(np.array([other if value is None else rows.get(str(value), other) for value in values],
+                                        dtype=np.int64))
+        return self._assemble(ordinals, flags, column_rows)
+
+    def predict_proba(self, data):
+        return self.forest.predict_proba(self.transform(data))
+
+    def decide(self, probabilities):
+        """Predicted classes from rows of class probabilities, through the saved decision weights."""
+        return self.classes_.take((probabilities * self.class_weights).argmax(axis=1))
+
+    def predict(self, data):
+        return self.decide(self.predict_proba(data))
@@ -0,0 +1,185 @@
+"""Pre-aggregated accident and people counts for the exploratory charts.
+
+``AccidentCube.build`` counts people (rows) and distinct accidents
+(``ACCNUM``) once, and ``query`` answers slices and roll-ups of them by
+summing pre-counted cells - thousands of rows instead of every person, and
+no ``nunique``.
+
+Crossing every dimension would leave about one cell per accident, so the
+counts are kept for a few groups of dimensions (``CUBOIDS``: time, place,
+conditions) and a query is answered from the smallest one holding all the
+columns it asks for.
+
+Distinct accident counts only add up over columns describing the accident: an
+accident is in exactly one YEAR or Division, but two people in it can have
+different INJURY levels. So every cuboid is counted once at accident grain and
+once per person level column (``PERSON_DIMENSIONS``), and a query can use one
+person level column at a time, filtered to a single value unless it is also
+a column of the result. An accident whose rows disagree on an accident level
+column is counted under the values of its first row.
+
+All the counts are stacked in one Parquet file, with a ``cuboid`` column and
+a ``grain`` column naming the person level column of the row ('' for the
+accident grain); columns a cuboid doesn't have are left missing.
+
+    python -m ksi explore --by YEAR INJURY --where Division=D11 --plot injuries.html
+"""
+import argparse
+import os
+
+import pandas as pd
+
+from ksi.data import DATA_URL, load_ksi
+
+# Groups of columns describing the accident - the same for every person involved
+CUBOIDS = {
+    'time': ['YEAR', 'MONTH', 'HOUR', 'WEEKDAY'],
+    'place': ['YEAR', 'HOUR', 'Division', 'District', 'ROAD_CLASS'],
+    'conditions': ['YEAR', 'Division', 'VISIBILITY', 'LIGHT', 'RDSFCOND'],
+}
+
+# Columns describing the person
+PERSON_DIMENSIONS = ['INJURY', 'INVTYPE', 'INVAGE']
+
+MEASURES = ['accidents', 'people']
+
+CUBE_FILE = 'ksi_cube.parquet'
+
+
+class AccidentCube:
+    """Accident and people counts by groups of columns, read back with ``query``."""
+
+    def __init__(self, table, cuboids=CUBOIDS, person_dimensions=PERSON_DIMENSIONS):
+        self.table = table
+        self.cuboids = {name: list(columns) for name, columns in cuboids.items()}
+        self.person_dimensions = list(person_dimensions)
+        self.dimensions = list(dict.fromkeys(column for columns in self.cuboids.values() for column in columns))
+        self._parts = {key: part for key, part in table.groupby(['cuboid', 'grain'], observed=True)}
+
+    @classmethod
+    def build(cls, data, cuboids=CUBOIDS, person_dimensions=PERSON_DIMENSIONS):
+        """Count the rows of a raw KSI DataFrame into a cube."""
+        dimensions = list(dict.fromkeys(column for columns in cuboids.values() for column in columns))
+        columns = dimensions + list(person_dimensions)
+        frame = data[['ACCNUM'] + columns].copy()
+        for column in columns:
+            if pd.api.types.is_integer_dtype(frame[column].dtype):
+                # Nullable, so the columns a cuboid doesn't have can be left missing without turning into floats
+                frame[column] = frame[column].astype(frame[column].dtype.name.capitalize())
+
+        tables = []
+        for grain in [''] + list(person_dimensions):
+            rows = frame.drop_duplicates(['ACCNUM', grain] if grain else 'ACCNUM')
+            for name, keys in cuboids.items():
+                keys = list(keys) + ([grain] if grain else [])
+                table = pd.DataFrame({
+                    'accidents': rows.groupby(keys, observed=True, sort=False, dropna=False).size(),
+                    'people': frame.groupby(keys, observed=True, sort=False, dropna=False).size(),
+                }).fillna(0).astype('int64').reset_index()
+                for column in columns:
+                    if column not in keys:
+                        table[column] = frame[column].iloc[:0].reindex(range(len(table))).to_numpy()
+                        table[column] = table[column].astype(frame[column].dtype)
+                table.insert(0, 'cuboid', name)
+                table.insert(1, 'grain', grain)
+                tables.append(table[['cuboid', 'grain'] + columns + MEASURES])
+        table = pd.concat(tables, ignore_index=True)
+        table[['cuboid', 'grain']] = table[['cuboid', 'grain']].astype('category')
+        return cls(table, cuboids, person_dimensions)
+
+    def query(self, by, where=None):
+        """Accident and people counts by the columns in ``by``.
+
+        ``where`` maps columns to a value or a list of values to keep. Returns
+        a DataFrame with the ``by`` columns, ``accidents`` and ``people``.
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        where = {column: values if isinstance(values, (list, tuple, set)) else [values]
+                 for column, values in (where or {}).items()}
+        asked = list(dict.fromkeys(by + list(where)))
+        unknown = [column for column in asked if column not in self.dimensions + self.person_dimensions]
+        if unknown:
+            raise ValueError('the cube has no %s column' % ', '.join(unknown))
+        persons = [column for column in asked if column in self.person_dimensions]
+        if len(persons) > 1:
+            raise ValueError('accidents can only be counted by one of %s at a time, not %s'
+                             % (', '.join(self.person_dimensions), ', '.join(persons)))
+        grain = persons[0] if persons else ''
+        if grain and grain not in by and len(where[grain]) > 1:
+            raise ValueError('an accident can have several %s values, so its counts for %s cannot be added up - '
+                             'add %s to by' % (grain, ', '.join(map(str, where[grain])), grain))
+        accident_columns = set(asked) - set(persons)
+        names = [name for name, columns in self.cuboids.items() if accident_columns <= set(columns)]
+        if not names:
+            raise ValueError('no cuboid has all of %s; the cuboids are %s' % (', '.join(sorted(accident_columns)),
+                                                                              self.cuboids))
+        table = min((self._parts[name, grain] for name in names), key=len)
+        for column, values in where.items():
+            table = table[table[column].isin(values)]
+        if not by:
+            return table[MEASURES].sum().to_frame().T
+        return table.groupby(by, observed=True, dropna=False)[MEASURES].sum().reset_index()
+
+    def save(self, path=CUBE_FILE):
+        table = self.table.copy()
+        table.attrs = {'cuboids': self.cuboids, 'person_dimensions': self.person_dimensions}
+        table.to_parquet(path, index=False)
+        return path
+
+    @classmethod
+    def load(cls, path=CUBE_FILE):
+        table = pd.read_parquet(path)
+        attrs, table.attrs = table.attrs, {}
+        return cls(table, attrs['cuboids'], attrs['person_dimensions'])
+
+
+def _value(text):
+    try:
+        return int(text)
+    except ValueError:
+        return text
+
+
+def parse_where(conditions):
+    """``['COLUMN=value,value', ...]`` as a ``where`` dict for ``AccidentCube.query``."""
+    where = {}
+    for condition in conditions:
+        column, separator, values = condition.partition('=')
+        if not separator:
+            raise ValueError('expected COLUMN=VALUE[,VALUE...], got %r' % condition)
+        where[column] = [_value(value) for value in values.split(',')]
+    return where
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Count accidents and people by any columns of the cube.')
+    parser.add_argument('--by', nargs='*', default=['YEAR'], help='columns to count by (default: %(default)s)')
+    parser.add_argument('--where', nargs='*', default=[], metavar='COLUMN=VALUE[,VALUE...]',
+                        help='keep only these values')
+    parser.add_argument('--cube', default=CUBE_FILE, help='saved cube, built first if missing '
+                                                          '(default: %(default)s)')
+    parser.add_argument('--input', default=DATA_URL, help='KSI rows to build the cube from '
+                                                          '(default: the course dataset)')
+    parser.add_argument('--rebuild', action='store_true', help='rebuild the cube even if it is saved')
+    parser.add_argument('--plot', metavar='HTML', help='also save a bar chart of the accident counts')
+    args = parser.parse_args(argv)
+    if args.rebuild or not os.path.exists(args.cube):
+        AccidentCube.build(load_ksi(args.input)).save(args.cube)
+    cube = AccidentCube.load(args.cube)
+    try:
+        table = cube.query(args.by, parse_where(args.where))
+    except ValueError as error:
+        parser.error(str(error))
+    print(table.to_string(index=False))
+    if args.plot:
+        if not args.by:
+            parser.error('--plot needs at least one --by column')
+        import plotly.express as px
+        chart = px.bar(table.astype({column: str for column in args.by[1:]}), x=args.by[0], y='accidents',
+                       color=args.by[1] if len(args.by) > 1 else None, barmode='group')
+        chart.write_html(args.plot)
+        print('saved', args.plot)
+
+
+if __name__ == '__main__':
+    main()
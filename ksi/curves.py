@@ -0,0 +1,108 @@
+"""How the random forest changes with the number of estimators.
+
+``estimator_curve`` grows a single RandomForestClassifier with
+``warm_start=True``, adding ``step`` trees at a time, and records the OOB
+score, test accuracy, per-class recall, fit time and model size after every
+step. Only the new trees are fitted, and only the new trees are evaluated:
+their class probabilities on the test set, and on the training rows left
+out of their bootstrap sample, are added to running sums, and their pickled
+size to a running total. sklearn's own ``oob_score=True`` would predict with
+every tree again at every step, and pickling the whole forest would copy
+every tree again, so the curve would cost more with every step; this way it
+costs about as much as fitting the largest forest once.
+"""
+import copy
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+# The bootstrap sample of every tree is only kept as its random state; these
+# rebuild it the way the forest's own OOB score does
+from sklearn.ensemble._forest import _generate_unsampled_indices, _get_n_samples_bootstrap
+from sklearn.metrics import recall_score
+
+
+def estimator_curve(train, train_labels, test, test_labels, max_estimators=300, step=10, **forest_params):
+    """One row per forest size from ``step`` to ``max_estimators`` trees.
+
+    ``forest_params`` are passed to RandomForestClassifier; bootstrapping is
+    required for the OOB score, which is the same as the forest's
+    ``oob_score_``. ``model_bytes`` adds up the pickled size of every tree to
+    that of the forest without them.
+    """
+    forest = RandomForestClassifier(n_estimators=step, warm_start=True, bootstrap=True, **forest_params)
+    train = np.asarray(train, dtype=np.float32)
+    train_labels = np.asarray(train_labels)
+    test = np.asarray(test, dtype=np.float32)
+    test_labels = np.asarray(test_labels)
+    n_samples_bootstrap = _get_n_samples_bootstrap(len(train), forest.max_samples, None)
+    rows = []
+    proba_sum = np.zeros((len(test), 1))
+    oob_sum = None
+    oob_count = np.zeros(len(train), dtype=np.int64)
+    model_bytes = 0
+    fit_seconds = 0.0
+    for n_estimators in range(step, max_estimators + 1, step):
+        forest.n_estimators = n_estimators
+        start = time.perf_counter()
+        forest.fit(train, train_labels)
+        step_seconds = time.perf_counter() - start
+        fit_seconds += step_seconds
+
+        new_trees = forest.estimators_[n_estimators - step:]
+        if oob_sum is None:
+            oob_sum = np.zeros((len(train), len(forest.classes_)))
+            shell = copy.copy(forest)
+            shell.estimators_ = []
+            model_bytes = len(pickle.dumps(shell, protocol=pickle.HIGHEST_PROTOCOL))
+        for tree in new_trees:
+            proba_sum = proba_sum + tree.predict_proba(test)
+            unsampled = _generate_unsampled_indices(tree.random_state, len(train), n_samples_bootstrap, None)
+            oob_sum[unsampled] += tree.predict_proba(train[unsampled])
+            oob_count[unsampled] += 1
+            model_bytes += len(pickle.dumps(tree, protocol=pickle.HIGHEST_PROTOCOL))
+        predictions = forest.classes_.take(proba_sum.argmax(axis=1))
+        # Rows no tree has left out yet count as predicting the first class, as in sklearn
+        oob_predictions = forest.classes_.take((oob_sum / np.maximum(oob_count, 1)[:, None]).argmax(axis=1))
+
+        recalls = recall_score(test_labels, predictions, labels=forest.classes_, average=None, zero_division=0)
+        rows.append({
+            'n_estimators': n_estimators,
+            'oob_score': float(np.mean(oob_predictions == train_labels)),
+            'test_accuracy': float(np.mean(predictions == test_labels)),
+            **{'recall_%s' % label: recall for label, recall in zip(forest.classes_, recalls)},
+            'fit_seconds': step_seconds,
+            'cumulative_fit_seconds': fit_seconds,
+            'model_bytes': model_bytes,
+        })
+    return pd.DataFrame(rows)
+
+
+def cheapest_forest(curve, target, metric='test_accuracy'):
+    """The smallest forest in ``curve`` whose ``metric`` reaches ``target``, or None."""
+    good_enough = curve[curve[metric] >= target]
+    return None if good_enough.empty else good_enough.iloc[0]
+
+
+def plot_estimator_curve(curve, ax=None):
+    """Accuracy against the number of trees, with the model size on a second axis."""
+    from matplotlib import pyplot as plt
+
+    if ax is None:
+        _, ax = plt.subplots(figsize=(10, 5))
+    ax.plot(curve['n_estimators'], curve['test_accuracy'], label='Test accuracy')
+    ax.plot(curve['n_estimators'], curve['oob_score'], label='OOB score')
+    for column in curve.columns:
+        if column.startswith('recall_'):
+            ax.plot(curve['n_estimators'], curve[column], linestyle=':', label=column.replace('_', ' '))
+    ax.set_xlabel('Number of estimators')
+    ax.set_ylabel('Score')
+    ax.legend(loc='lower left')
+
+    size_ax = ax.twinx()
+    size_ax.plot(curve['n_estimators'], curve['model_bytes'] / 2 ** 20, color='grey', linestyle='--')
+    size_ax.set_ylabel('Model size (MB, dashed)')
+    ax.set_title('Random forest accuracy and cost by number of estimators')
+    return ax
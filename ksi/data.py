@@ -0,0 +1,137 @@
+"""Loading the KSI dataset with a local columnar cache.
+
+The first time a source is loaded it is parsed once with explicit dtypes and
+saved as an uncompressed Feather file named after the SHA-256 of the raw CSV
+bytes. Later loads memory-map that file instead of fetching and parsing the
+CSV again, so the analysis can also run offline once the cache is warm.
+"""
+import hashlib
+import io
+import json
+import os
+import urllib.request
+
+import pandas as pd
+
+DATA_URL = "https://raw.githubusercontent.com/danielmaxsiegel/GBC-ML1/main/datasets/KSI_CLEAN.csv"
+
+# Free-text columns of KSI_CLEAN.csv - stored as categoricals, they repeat a
+# handful of values across every row
+CATEGORICAL_COLUMNS = ['Ward_Name', 'Hood_Name', 'Division', 'District',
+                       'STREET1', 'STREET2', 'OFFSET', 'ROAD_CLASS',
+                       'LOCCOORD', 'ACCLOC', 'TRAFFCTL', 'VISIBILITY',
+                       'LIGHT', 'RDSFCOND', 'ACCLASS', 'IMPACTYPE', 'INVTYPE',
+                       'INVAGE', 'INJURY', 'INITDIR', 'VEHTYPE', 'MANOEUVER',
+                       'DRIVACT', 'DRIVCOND', 'PEDTYPE', 'PEDACT', 'PEDCOND',
+                       'CYCLISTYPE', 'CYCACT', 'CYCCOND']
+
+# 0/1 dummy columns
+FLAG_COLUMNS = ['PEDESTRIAN', 'CYCLIST', 'AUTOMOBILE', 'MOTORCYCLE', 'TRUCK',
+                'TRSN_CITY_VEH', 'EMERG_VEH', 'PASSENGER', 'SPEEDING',
+                'AG_DRIV', 'REDLIGHT', 'ALCOHOL', 'DISABILITY', 'FATAL']
+
+DTYPES = {
+    'ACCNUM': 'int64',
+    'YEAR': 'int16',
+    'MONTH': 'int8',
+    'DAY': 'int8',
+    'HOUR': 'int8',
+    'MINUTES': 'int8',
+    'WEEKDAY': 'int8',
+    'LATITUDE': 'float64',
+    'LONGITUDE': 'float64',
+    'Ward_ID': 'int16',
+    'Hood_ID': 'int16',
+    'FATAL_NO': 'int16',
+    **{column: 'category' for column in CATEGORICAL_COLUMNS},
+    **{column: 'int8' for column in FLAG_COLUMNS},
+}
+
+# Only empty fields are missing - 'None' is a real INJURY level, and newer
+# pandas versions would otherwise read it as NaN
+READ_CSV_OPTIONS = dict(dtype=DTYPES, keep_default_na=False, na_values=[''])
+
+_INDEX_FILE = 'index.json'
+
+
+def default_cache_dir():
+    """Cache directory, overridable with the KSI_CACHE_DIR environment variable."""
+    return os.environ.get('KSI_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'ksi'))
+
+
+def _is_url(source):
+    return str(source).startswith(('http://', 'https://'))
+
+
+def _read_source(source):
+    if _is_url(source):
+        with urllib.request.urlopen(source) as response:
+            return response.read()
+    with open(source, 'rb') as f:
+        return f.read()
+
+
+def _read_index(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, _INDEX_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_index(cache_dir, index):
+    path = os.path.join(cache_dir, _INDEX_FILE)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def cache_path(digest, cache_dir=None):
+    return os.path.join(cache_dir or default_cache_dir(), 'KSI_%s.feather' % digest[:16])
+
+
+def parse_ksi(buffer):
+    """Parse raw KSI CSV bytes (or a path / file object) with the explicit dtypes."""
+    if isinstance(buffer, bytes):
+        buffer = io.BytesIO(buffer)
+    return pd.read_csv(buffer, **READ_CSV_OPTIONS)
+
+
+def read_cached(path):
+    """Memory-map a cached Feather copy of the dataset."""
+    from pyarrow import feather
+    return feather.read_feather(path, memory_map=True)
+
+
+def load_ksi(source=DATA_URL, cache_dir=None, refresh=False):
+    """Load the KSI dataset from a URL or local path, going through the cache.
+
+    Local files are always hashed so an edited file gets a new cache entry.
+    URLs are only fetched when there is no cached copy for them yet or when
+    ``refresh=True``; otherwise the last copy downloaded for that URL is used,
+    which also lets the analysis run offline.
+    """
+    cache_dir = cache_dir or default_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    index = _read_index(cache_dir)
+    key = str(source) if _is_url(source) else os.path.abspath(source)
+
+    if _is_url(source) and not refresh and key in index:
+        path = cache_path(index[key], cache_dir)
+        if os.path.exists(path):
+            return read_cached(path)
+
+    raw = _read_source(source)
+    digest = hashlib.sha256(raw).hexdigest()
+    path = cache_path(digest, cache_dir)
+    if not os.path.exists(path):
+        data = parse_ksi(raw)
+        # Write to a temporary name first so an interrupted run never leaves
+        # a truncated file behind under the final name
+        data.to_feather(path + '.tmp', compression='uncompressed')
+        os.replace(path + '.tmp', path)
+    if index.get(key) != digest:
+        index[key] = digest
+        _write_index(cache_dir, index)
+    return read_cached(path)
@@ -0,0 +1,140 @@
+"""Tune how the forest's probabilities become a predicted INJURY level.
+
+``predict`` takes the most probable level, which rarely predicts the fatal
+and major injuries we care about most. Retraining with class weights costs a
+forest fit per try; instead, ``WeightedDecisionClassifier`` multiplies the
+probabilities of every level by a weight before taking the most probable -
+the same decision as per-class thresholds, or a cost matrix that only charges
+for missing each level - so a decision rule is tried on predicted
+probabilities alone.
+
+``tune_decision_weights`` scores thousands of weightings at once on the
+probabilities of validation rows (``cached_predict_proba`` computes them once
+per model and rows): every weighting's predictions and confusion matrix come
+out of a few array operations over a block of candidates, and the blocks run
+in parallel threads. It keeps the weighting with the best recall on the
+target levels whose precision on each of them stays within budget. The
+tuned classifier is the last step of the saved pipeline, so the rule ships
+with the model.
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+from joblib import Memory, Parallel, delayed
+from sklearn.base import BaseEstimator, ClassifierMixin, clone
+
+from ksi.metrics import INJURY_LABELS
+
+# Encoded INJURY levels of major and fatal injuries (see ksi.cleaning.ORDINAL_MAPS)
+TARGET_CLASSES = [2, 3]
+
+# Weights tried for every target level, the other levels keep a weight of 1
+WEIGHT_GRID = np.geomspace(1, 100, 60)
+
+
+class WeightedDecisionClassifier(BaseEstimator, ClassifierMixin):
+    """A fitted classifier predicting the level with the highest weighted probability.
+
+    ``class_weights`` has one weight per class of ``estimator``, in the order
+    of ``classes_``; ``None`` is plain argmax. ``fit`` fits a clone of
+    ``estimator`` as ``estimator_``, whose ``predict_proba`` this is;
+    ``from_fitted`` wraps an estimator that is already fitted.
+    """
+
+    def __init__(self, estimator, class_weights=None):
+        self.estimator = estimator
+        self.class_weights = class_weights
+
+    @classmethod
+    def from_fitted(cls, estimator, class_weights=None):
+        """Wrap a fitted ``estimator`` without refitting it, e.g. the notebook's forest."""
+        classifier = cls(estimator, class_weights)
+        classifier.estimator_ = estimator
+        return classifier
+
+    @property
+    def classes_(self):
+        return self.estimator_.classes_
+
+    def __sklearn_is_fitted__(self):
+        return hasattr(self, 'estimator_')
+
+    def fit(self, X, y):
+        self.estimator_ = clone(self.estimator).fit(X, y)
+        return self
+
+    def predict_proba(self, X):
+        return self.estimator_.predict_proba(X)
+
+    def decide(self, probabilities):
+        """Predicted classes from rows of class probabilities."""
+        if self.class_weights is not None:
+            probabilities = probabilities * np.asarray(self.class_weights)
+        return self.classes_.take(probabilities.argmax(axis=1))
+
+    def predict(self, X):
+        return self.decide(self.predict_proba(X))
+
+
+def _predict_proba(model, X):
+    return model.predict_proba(X)
+
+
+def cached_predict_proba(model, X, cache_dir=None):
+    """``model.predict_proba(X)``, read from ``cache_dir`` if it was computed before for the same model and rows."""
+    predict_proba = Memory(cache_dir, verbose=0).cache(_predict_proba) if cache_dir else _predict_proba
+    return predict_proba(model, X)
+
+
+def weighted_confusions(probabilities, y, weights):
+    """Confusion matrix (rows are true classes) of every row of ``weights``, stacked.
+
+    ``y`` are class positions, 0 to ``n_classes - 1``.
+    """
+    n_candidates, n_classes = weights.shape
+    predicted = (probabilities[None, :, :] * weights[:, None, :]).argmax(axis=2)
+    cells = (np.arange(n_candidates)[:, None] * n_classes + y[None, :]) * n_classes + predicted
+    return np.bincount(cells.ravel(), minlength=n_candidates * n_classes * n_classes).reshape(
+        n_candidates, n_classes, n_classes)
+
+
+def tune_decision_weights(probabilities, y, classes, targets=TARGET_CLASSES, min_precision=0.3, grid=WEIGHT_GRID,
+                          class_names=INJURY_LABELS, block_size=256, n_jobs=-1):
+    """Class weights with the best mean recall on ``targets`` at ``min_precision`` or more on each of them.
+
+    Every combination of ``grid`` values is tried as the weights of the
+    target classes, ties going to the higher accuracy. Returns the weights,
+    in the order of ``classes``, and a DataFrame of every candidate's
+    weights, recall and precision per target and accuracy.
+    """
+    classes = np.asarray(classes)
+    y = np.searchsorted(classes, np.asarray(y))
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    positions = [int(np.searchsorted(classes, target)) for target in targets]
+    weights = np.ones((len(grid) ** len(positions), len(classes)))
+    weights[:, positions] = list(itertools.product(grid, repeat=len(positions)))
+
+    confusions = np.concatenate(Parallel(n_jobs=n_jobs, prefer='threads')(
+        delayed(weighted_confusions)(probabilities, y, weights[start:start + block_size])
+        for start in range(0, len(weights), block_size)))
+    hits = np.diagonal(confusions, axis1=1, axis2=2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        recall = np.nan_to_num(hits / confusions.sum(axis=2))
+        # A level that is never predicted raises no false alarms, so it is within any precision budget
+        precision = np.nan_to_num(hits / confusions.sum(axis=1), nan=1.0)
+    accuracy = hits.sum(axis=1) / len(y)
+
+    names = [class_names[position] if class_names is not None else str(classes[position]) for position in positions]
+    table = pd.DataFrame({'weight %s' % name: weights[:, position] for name, position in zip(names, positions)})
+    for name, position in zip(names, positions):
+        table['recall %s' % name] = recall[:, position]
+        table['precision %s' % name] = precision[:, position]
+    table['target recall'] = recall[:, positions].mean(axis=1)
+    table['accuracy'] = accuracy
+    table['feasible'] = (precision[:, positions] >= min_precision).all(axis=1)
+    if not table['feasible'].any():
+        raise ValueError('no weighting reaches a precision of %g on %s - lower min_precision'
+                         % (min_precision, ', '.join(names)))
+    best = table[table['feasible']].sort_values(['target recall', 'accuracy'], ascending=False).index[0]
+    return weights[best], table
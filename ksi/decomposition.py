@@ -0,0 +1,91 @@
+"""Fit the TruncatedSVD once per matrix, with the fastest solver that is accurate enough.
+
+``fit_svd`` caches the fitted TruncatedSVD on disk with ``cache_dir``, keyed
+by a hash of the matrix and the solver parameters, so a rerun on unchanged
+data skips the decomposition entirely. The projection itself is a single
+sparse matrix product (see ``ksi.features``) and isn't worth caching.
+
+``compare_svd_solvers`` times the ARPACK solver and the randomized solver
+with a range of power iterations on the matrix at hand. Truncated SVD keeps
+the directions that capture the most variance, so each solver is scored by
+the variance its components capture relative to the best solver, along with
+the worst singular value error and how far its components turned from the
+best solver's. ``fastest_svd_solver`` picks the quickest one that captures
+all but ``tolerance`` of that variance and keeps every component in place:
+the features are single components, picked by number, so a solver that
+captures the same subspace with the components mixed up isn't good enough.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+from joblib import Memory
+from sklearn.decomposition import TruncatedSVD
+
+RSEED = 42
+
+# (algorithm, n_iter) pairs - ARPACK ignores n_iter
+SOLVERS = [('arpack', 5)] + [('randomized', n_iter) for n_iter in (1, 2, 3, 5, 7)]
+
+
+def _fit_svd(X, n_components, algorithm, n_iter, random_state):
+    return TruncatedSVD(n_components=n_components, algorithm=algorithm, n_iter=n_iter,
+                        random_state=random_state).fit(X)
+
+
+def fit_svd(X, n_components=34, algorithm='randomized', n_iter=7, random_state=RSEED, cache_dir=None):
+    """A TruncatedSVD fitted on ``X``, read from ``cache_dir`` if it was fitted on the same matrix before."""
+    fit = Memory(cache_dir, verbose=0).cache(_fit_svd) if cache_dir else _fit_svd
+    return fit(X, n_components, algorithm, n_iter, random_state)
+
+
+def _compare_svd_solvers(X, n_components, solvers, random_state):
+    fits = []
+    for algorithm, n_iter in solvers:
+        start = time.perf_counter()
+        svd = _fit_svd(X, n_components, algorithm, n_iter, random_state)
+        fits.append((algorithm, n_iter, time.perf_counter() - start, svd))
+
+    # Both solvers return the singular values in decreasing order
+    best = max(fits, key=lambda fit: np.sum(fit[3].singular_values_.astype(np.float64) ** 2))[3]
+    best_variance = np.sum(best.singular_values_.astype(np.float64) ** 2)
+    rows = []
+    for algorithm, n_iter, seconds, svd in fits:
+        singular_values = svd.singular_values_.astype(np.float64)
+        cosines = np.abs(np.einsum('ij,ij->i', svd.components_.astype(np.float64),
+                                   best.components_.astype(np.float64)))
+        rows.append({
+            'algorithm': algorithm,
+            'n_iter': n_iter,
+            'seconds': seconds,
+            'captured_variance': np.sum(singular_values ** 2) / best_variance,
+            'max_singular_value_error': np.max(np.abs(singular_values - best.singular_values_) /
+                                               best.singular_values_),
+            'min_component_cosine': np.min(cosines),
+        })
+    return pd.DataFrame(rows)
+
+
+def compare_svd_solvers(X, n_components=34, solvers=SOLVERS, random_state=RSEED, cache_dir=None):
+    """Fit time and accuracy of every ``(algorithm, n_iter)`` in ``solvers`` on ``X``.
+
+    ``captured_variance`` is the variance the components capture over the
+    most the solvers managed, ``max_singular_value_error`` the largest
+    relative difference from that solver's singular values and
+    ``min_component_cosine`` the smallest absolute cosine between a component
+    and the same component of that solver. With ``cache_dir`` the table -
+    timings included - is kept from the first run on the same matrix.
+    """
+    compare = Memory(cache_dir, verbose=0).cache(_compare_svd_solvers) if cache_dir else _compare_svd_solvers
+    return compare(X, n_components, [tuple(solver) for solver in solvers], random_state)
+
+
+def fastest_svd_solver(table, tolerance=1e-3, min_cosine=0.99):
+    """``algorithm`` and ``n_iter`` of the fastest accurate solver in a ``compare_svd_solvers`` table.
+
+    Accurate means losing at most ``tolerance`` of the captured variance,
+    with every component at least ``min_cosine`` from the best solver's.
+    """
+    accurate = table[(table['captured_variance'] >= 1 - tolerance) & (table['min_component_cosine'] >= min_cosine)]
+    fastest = accurate.loc[accurate['seconds'].idxmin()]
+    return {'algorithm': fastest['algorithm'], 'n_iter': int(fastest['n_iter'])}
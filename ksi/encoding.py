@@ -0,0 +1,88 @@
+"""Sparse one-hot encoding of the categorical KSI columns.
+
+``SparseOneHotEncoder`` learns the vocabulary of every column once and then
+emits all the indicator columns as a single CSR matrix in one pass, instead of
+growing a dense DataFrame with a ``get_dummies``/``concat``/``drop`` round per
+column. Every row has exactly one non-zero per encoded column, so the CSR
+arrays can be built directly from the categorical codes.
+"""
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.base import BaseEstimator, TransformerMixin
+
+from ksi.cleaning import as_categorical
+
+# Columns we one hot encode, in the order their indicator columns appear
+ONE_HOT_COLUMNS = ['LOCCOORD', 'ACCLOC', 'TRAFFCTL', 'IMPACTYPE', 'INVTYPE',
+                   'VEHTYPE', 'MANOEUVER', 'DRIVACT', 'DRIVCOND', 'PEDTYPE',
+                   'PEDACT', 'PEDCOND', 'CYCLISTYPE', 'CYCACT', 'CYCCOND']
+
+OTHER = 'Other'
+
+
+class SparseOneHotEncoder(BaseEstimator, TransformerMixin):
+    """One hot encode DataFrame columns into a CSR matrix.
+
+    Every column gets an ``OTHER`` indicator (added if the training data has
+    no such category), and categories that weren't seen during ``fit`` - or
+    missing values - are counted there, so new data always maps onto the same
+    feature columns. Feature names follow ``pd.get_dummies``: ``COLUMN_value``.
+    """
+
+    def __init__(self, columns=ONE_HOT_COLUMNS, dtype=np.float32):
+        self.columns = columns
+        self.dtype = dtype
+
+    def fit(self, X, y=None):
+        self.categories_ = [[] for _ in self.columns]
+        return self.partial_fit(X)
+
+    def partial_fit(self, X, y=None):
+        """Add the categories of ``X`` that aren't in the vocabulary yet.
+
+        Feature columns stay sorted by category within each column, so new
+        categories shift the columns after them; match them up by
+        ``feature_names_``.
+        """
+        if not hasattr(self, 'categories_'):
+            return self.fit(X)
+        for position, column in enumerate(self.columns):
+            values = as_categorical(X[column])
+            seen = np.bincount(values.codes[values.codes >= 0], minlength=len(values.categories)) > 0
+            categories = set(values.categories[seen])
+            categories.update(self.categories_[position])
+            categories.add(OTHER)
+            self.categories_[position] = sorted(categories)
+        self.offsets_ = np.cumsum([0] + [len(categories) for categories in self.categories_])
+        self.feature_names_ = ['%s_%s' % (column, category)
+                               for column, categories in zip(self.columns, self.categories_)
+                               for category in categories]
+        return self
+
+    def _column_indices(self, X, position):
+        values = as_categorical(X[self.columns[position]])
+        vocabulary = {category: i for i, category in enumerate(self.categories_[position])}
+        other = vocabulary[OTHER]
+        # One extra trailing entry so missing values (code -1) land on OTHER too
+        lookup = np.array([vocabulary.get(category, other) for category in values.categories] + [other],
+                          dtype=np.int32)
+        return lookup.take(values.codes) + self.offsets_[position]
+
+    def categorical(self, X, position):
+        """Column ``position`` of ``X`` as a ``pd.Categorical`` over its fitted categories, unseen ones as OTHER."""
+        codes = self._column_indices(X, position) - self.offsets_[position]
+        return pd.Categorical.from_codes(codes, self.categories_[position])
+
+    def transform(self, X):
+        n_rows, n_columns = len(X), len(self.columns)
+        indices = np.empty((n_rows, n_columns), dtype=np.int32)
+        for position in range(n_columns):
+            indices[:, position] = self._column_indices(X, position)
+        indptr = np.arange(0, n_rows * n_columns + 1, n_columns, dtype=np.int64)
+        data = np.ones(n_rows * n_columns, dtype=self.dtype)
+        # Column offsets grow with position, so each row's indices are already sorted
+        return sp.csr_matrix((data, indices.ravel(), indptr), shape=(n_rows, self.offsets_[-1]))
+
+    def get_feature_names_out(self, input_features=None):
+        return np.asarray(self.feature_names_, dtype=object)
@@ -0,0 +1,148 @@
+"""What the trained forest's predictions depend on.
+
+``permutation_importances`` measures how much the score drops when one
+feature's values are shuffled. Every (feature, repeat) pair is a separate job
+in a process pool, reading one memory-mapped copy of the matrix.
+
+Most features are SVD components, which say little on their own.
+``input_importances`` spreads each component's importance over the flag and
+one hot columns it is made of, in proportion to their squared loadings in
+``svd.components_`` (every component's squared loadings add up to 1).
+``field_importances`` then adds the one hot columns up per original field,
+e.g. VEHTYPE.
+
+``ForestExplainer`` splits every predicted probability into a bias (the
+forest's prior) plus one contribution per feature: along each tree's path,
+the change in class probability at every split is credited to the feature
+it splits on. The contributions of every leaf are worked out once from the
+node arrays of ``ksi.forest.FlatForest``, one tree level at a time for all
+leaves together, so explaining a batch is a leaf lookup and a sum per tree.
+"""
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.metrics import check_scoring
+
+from ksi.encoding import ONE_HOT_COLUMNS
+from ksi.forest import FlatForest
+from ksi.validation import memmapped
+
+RSEED = 42
+
+
+def _permuted_score(model, X, y, column, seed, scorer):
+    X = np.array(X)
+    X[:, column] = np.random.RandomState(seed).permutation(X[:, column])
+    return scorer(model, X, y)
+
+
+def permutation_importances(model, X, y, feature_names=None, n_repeats=5, scoring=None, n_jobs=-1,
+                            random_state=RSEED):
+    """Mean and standard deviation of the score drop when each feature is shuffled, most important first.
+
+    ``scoring`` is any sklearn scorer name; the default is the model's
+    ``score`` (accuracy for the forest). Returns a DataFrame indexed by
+    feature name with ``importance`` and ``std`` columns.
+    """
+    X = np.ascontiguousarray(X)
+    y = np.asarray(y)
+    feature_names = list(feature_names) if feature_names is not None else list(range(X.shape[1]))
+    scorer = check_scoring(model, scoring=scoring)
+    baseline = scorer(model, X, y)
+    seeds = np.random.RandomState(random_state).randint(np.iinfo(np.int32).max, size=(X.shape[1], n_repeats))
+    with memmapped(X, y) as (X_shared, y_shared):
+        scores = Parallel(n_jobs=n_jobs)(
+            delayed(_permuted_score)(model, X_shared, y_shared, column, seeds[column, repeat], scorer)
+            for column in range(X.shape[1]) for repeat in range(n_repeats))
+    drops = baseline - np.asarray(scores).reshape(X.shape[1], n_repeats)
+    table = pd.DataFrame({'importance': drops.mean(axis=1), 'std': drops.std(axis=1)},
+                         index=pd.Index(feature_names, name='feature', dtype=object))
+    return table.sort_values('importance', ascending=False)
+
+
+def input_importances(importances, svd, input_names):
+    """Importances of SVD components spread over the input columns of ``svd``.
+
+    ``importances`` is indexed by feature: component numbers are spread over
+    ``input_names`` (the SVD's input columns, in order) by their squared
+    loadings, other features are kept as they are.
+    """
+    importances = pd.Series(importances)
+    components = [feature for feature in importances.index if not isinstance(feature, str)]
+    weights = svd.components_[components].astype(np.float64) ** 2
+    spread = pd.Series(importances[components].to_numpy() @ weights, index=list(input_names))
+    kept = importances.drop(index=components)
+    return pd.concat([spread.groupby(level=0, sort=False).sum(), kept]).sort_values(ascending=False)
+
+
+def field_of(column):
+    """The original KSI field of an input column name, e.g. ``VEHTYPE`` for ``VEHTYPE_Automobile``."""
+    for field in ONE_HOT_COLUMNS:
+        if column.startswith(field + '_'):
+            return field
+    return column
+
+
+def field_importances(column_importances):
+    """Input column importances added up per original field, most important first."""
+    column_importances = pd.Series(column_importances)
+    fields = [field_of(str(column)) for column in column_importances.index]
+    return column_importances.groupby(fields).sum().sort_values(ascending=False)
+
+
+class ForestExplainer:
+    """Per-prediction feature contributions of a fitted RandomForestClassifier.
+
+    For every row, ``bias_`` plus the contributions of all features equals
+    the forest's ``predict_proba``, up to floating point rounding.
+    """
+
+    def __init__(self, forest, feature_names=None):
+        self.flat = FlatForest(forest)
+        self.classes_ = self.flat.classes_
+        n_features = self.flat.n_features_in_
+        self.feature_names = list(feature_names) if feature_names is not None else list(range(n_features))
+        self.bias_ = self.flat.value[self.flat.roots].mean(axis=0)
+
+        left, right, value, feature = self.flat.left, self.flat.right, self.flat.value, self.flat.feature
+        nodes = np.arange(len(left))
+        internal = left != nodes
+        parent = np.full(len(left), -1, dtype=np.int64)
+        parent[left[internal]] = nodes[internal]
+        parent[right[internal]] = nodes[internal]
+        leaves = np.flatnonzero(~internal)
+        self._leaf_row = np.full(len(left), -1, dtype=np.int64)
+        self._leaf_row[leaves] = np.arange(len(leaves))
+
+        # Walk up from every leaf at once, one level per step, crediting each split with the change it made
+        self._leaf_contributions = np.zeros((len(leaves), n_features, len(self.classes_)))
+        rows, node = np.arange(len(leaves)), leaves
+        while len(node):
+            above = parent[node]
+            climbing = above >= 0
+            rows, node, above = rows[climbing], node[climbing], above[climbing]
+            np.add.at(self._leaf_contributions, (rows, feature[above]), value[node] - value[above])
+            node = above
+
+    def contributions(self, X, block_size=8192):
+        """Contribution of every feature to every class probability, shape ``(n_rows, n_features, n_classes)``."""
+        leaves = self._leaf_row[self.flat.apply(X)]
+        n_trees = leaves.shape[1]
+        contributions = np.zeros((len(leaves),) + self._leaf_contributions.shape[1:])
+        for start in range(0, len(leaves), block_size):
+            block = contributions[start:start + block_size]
+            for tree in range(n_trees):
+                block += self._leaf_contributions[leaves[start:start + block_size, tree]]
+        return contributions / n_trees
+
+    def explain(self, X, class_index=-1):
+        """Contributions to the probability of ``classes_[class_index]``, one column per feature.
+
+        The ``bias`` and ``probability`` columns are the forest's prior and
+        its predicted probability of that class.
+        """
+        contributions = self.contributions(X)[:, :, class_index]
+        table = pd.DataFrame(contributions, columns=self.feature_names)
+        table['bias'] = self.bias_[class_index]
+        table['probability'] = contributions.sum(axis=1) + self.bias_[class_index]
+        return table
@@ -0,0 +1,86 @@
+"""The model's feature matrix, assembled once into compact contiguous memory.
+
+Building the features as a DataFrame - ``pd.concat`` of the ordinal columns
+and the SVD components, then ``drop``, ``iloc`` and sklearn's own conversion
+to float32 - makes a full copy at every step. ``assemble_features`` instead
+allocates one C-ordered float32 array, the dtype the forest works in, and
+writes every feature straight into its column: the ordinal columns from their
+int8 codes, and the SVD components by projecting a block of rows of the
+sparse indicator matrix at a time. ``FeatureMatrix`` keeps the feature names
+next to it, and its ``values`` go to TruncatedSVD, RFE and the random forest
+without another conversion.
+"""
+import numpy as np
+import pandas as pd
+
+
+class FeatureMatrix:
+    """A 2-d NumPy array and the name of each of its columns.
+
+    Names are ordinal column names or SVD component numbers, as in
+    ``ksi.pipeline.FEATURES_TO_DROP``.
+    """
+
+    def __init__(self, values, columns):
+        if values.ndim != 2 or values.shape[1] != len(columns):
+            raise ValueError('%d column names for a matrix of shape %s' % (len(columns), values.shape))
+        self.values = values
+        self.columns = list(columns)
+        self._positions = {column: position for position, column in enumerate(self.columns)}
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def __len__(self):
+        return len(self.values)
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None or np.dtype(dtype) == self.values.dtype:
+            return self.values.copy() if copy else self.values
+        return self.values.astype(dtype)
+
+    def positions(self, columns):
+        missing = [column for column in columns if column not in self._positions]
+        if missing:
+            raise KeyError('no feature named %s' % ', '.join(map(str, missing)))
+        return [self._positions[column] for column in columns]
+
+    def select(self, columns):
+        """A new matrix of ``columns``, in that order."""
+        # np.take keeps the copy C-ordered, where fancy indexing along columns would return it Fortran-ordered
+        return FeatureMatrix(np.take(self.values, self.positions(columns), axis=1), columns)
+
+    def drop(self, columns):
+        """A new matrix without ``columns``."""
+        self.positions(columns)
+        return self.select([column for column in self.columns if column not in set(columns)])
+
+    def take(self, rows):
+        """A new matrix of ``rows`` (positions or a boolean mask)."""
+        return FeatureMatrix(self.values[rows], self.columns)
+
+    def head(self, n=5):
+        return pd.DataFrame(self.values[:n], columns=self.columns)
+
+
+def assemble_features(data, svd, X_sparse, features, dtype=np.float32, chunk_rows=65536):
+    """The ``features`` of ``data`` and its sparse indicator matrix ``X_sparse``, as a FeatureMatrix.
+
+    ``features`` are column names of ``data`` (already encoded as numbers)
+    and component numbers of the fitted ``svd``.
+    """
+    values = np.empty((X_sparse.shape[0], len(features)), dtype=dtype)
+    components = []
+    for position, feature in enumerate(features):
+        if isinstance(feature, str):
+            values[:, position] = data[feature].to_numpy()
+        else:
+            components.append(position)
+    if components:
+        loadings = np.ascontiguousarray(svd.components_[[features[position] for position in components]].T,
+                                        dtype=dtype)
+        # The same projection as svd.transform, without a float64 copy of every component
+        for start in range(0, len(values), chunk_rows):
+            values[start:start + chunk_rows, components] = X_sparse[start:start + chunk_rows] @ loadings
+    return FeatureMatrix(values, features)
@@ -0,0 +1,136 @@
+"""A fitted RandomForestClassifier flattened into contiguous node arrays.
+
+sklearn's ``predict`` has a fixed per-call overhead (input validation, a
+thread pool over the trees) that dominates when scoring one record at a time.
+``FlatForest`` copies every tree into shared NumPy arrays - split feature,
+threshold, children and per-leaf class probabilities - and walks all trees
+for a whole batch at once. When numba is installed the walk can be compiled;
+otherwise a vectorized NumPy loop over tree depth is used. Both give the same
+predictions as ``RandomForestClassifier.predict``, with probabilities equal to
+``predict_proba`` up to floating point rounding.
+
+numba is only imported the first time the compiled walk is used. Loading it
+and the cached machine code takes longer than the NumPy walk needs for tens
+of thousands of rows, so by default smaller batches skip it; a long running
+process such as the prediction server asks for it with ``compiled=True``.
+"""
+import functools
+
+import numpy as np
+
+# sklearn marks leaves with feature == -2 (TREE_UNDEFINED)
+LEAF = -2
+
+# Smallest batch for which loading numba pays off, when compiled=None; the
+# compiled walk is about twice as fast per row once loaded
+COMPILED_MIN_ROWS = 100_000
+
+
+class FlatForest:
+    """Node arrays of every tree of a fitted RandomForestClassifier.
+
+    ``compiled`` picks the tree walk: ``True`` the numba one whenever numba is
+    installed, ``False`` always the NumPy one and ``None`` the numba one for
+    batches of ``COMPILED_MIN_ROWS`` rows or more.
+    """
+
+    def __init__(self, forest, compiled=None):
+        self.compiled = compiled
+        trees = [estimator.tree_ for estimator in forest.estimators_]
+        sizes = [tree.node_count for tree in trees]
+        self.roots = np.cumsum([0] + sizes[:-1]).astype(np.int64)
+        self.classes_ = forest.classes_
+        self.n_features_in_ = forest.n_features_in_
+        self.max_depth = max(tree.max_depth for tree in trees)
+
+        self.feature = np.concatenate([tree.feature for tree in trees]).astype(np.int64)
+        self.threshold = np.concatenate([tree.threshold for tree in trees]).astype(np.float64)
+        # Children are stored as global node ids; leaves point at themselves,
+        # which lets the NumPy walk run a fixed number of steps
+        offsets = np.repeat(self.roots, sizes)
+        left = np.concatenate([tree.children_left for tree in trees]).astype(np.int64)
+        right = np.concatenate([tree.children_right for tree in trees]).astype(np.int64)
+        nodes = np.arange(len(left), dtype=np.int64)
+        is_leaf = self.feature == LEAF
+        self.left = np.where(is_leaf, nodes, left + offsets)
+        self.right = np.where(is_leaf, nodes, right + offsets)
+        self.feature[is_leaf] = 0
+
+        # Same normalisation as DecisionTreeClassifier.predict_proba
+        value = np.concatenate([tree.value[:, 0, :len(self.classes_)] for tree in trees]).astype(np.float64)
+        normalizer = value.sum(axis=1, keepdims=True)
+        normalizer[normalizer == 0.0] = 1.0
+        self.value = np.ascontiguousarray(value / normalizer)
+
+    # Attributes saved by ``to_arrays``, enough to predict without sklearn
+    ARRAYS = ['roots', 'feature', 'threshold', 'left', 'right', 'value', 'classes_']
+
+    def to_arrays(self):
+        """The node arrays as a dict of NumPy arrays, e.g. for ``np.savez``."""
+        arrays = {name: getattr(self, name) for name in self.ARRAYS}
+        arrays['n_features_in_'] = np.int64(self.n_features_in_)
+        arrays['max_depth'] = np.int64(self.max_depth)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, compiled=None):
+        """A FlatForest from the arrays of ``to_arrays``, without the fitted forest."""
+        flat = cls.__new__(cls)
+        flat.compiled = compiled
+        for name in cls.ARRAYS:
+            setattr(flat, name, np.asarray(arrays[name]))
+        flat.n_features_in_ = int(arrays['n_features_in_'])
+        flat.max_depth = int(arrays['max_depth'])
+        return flat
+
+    def apply(self, X):
+        """Global leaf id reached in every tree, shape ``(n_samples, n_trees)``."""
+        # Trees compare float32 features against float64 thresholds, like sklearn
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if self.compiled or (self.compiled is None and len(X) >= COMPILED_MIN_ROWS):
+            walk = compiled_walk()
+            if walk is not None:
+                return walk(X, self.roots, self.feature, self.threshold, self.left, self.right)
+        rows = np.arange(len(X))[:, None]
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[node]] <= self.threshold[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+        return node
+
+    def predict_proba(self, X, block_size=8192):
+        leaves = self.apply(X)
+        proba = np.empty((len(leaves), len(self.classes_)))
+        # Summing over the tree axis adds the trees one after another, in
+        # estimator order; rows are done in blocks to bound the gathered array
+        for start in range(0, len(leaves), block_size):
+            block = leaves[start:start + block_size]
+            proba[start:start + block_size] = self.value[block].sum(axis=1)
+        return proba / leaves.shape[1]
+
+    def predict(self, X):
+        return self.classes_.take(self.predict_proba(X).argmax(axis=1))
+
+
+def _walk(X, roots, feature, threshold, left, right):
+    leaves = np.empty((X.shape[0], roots.shape[0]), dtype=np.int64)
+    for i in range(X.shape[0]):
+        for t in range(roots.shape[0]):
+            node = roots[t]
+            while left[node] != node:
+                if X[i, feature[node]] <= threshold[node]:
+                    node = left[node]
+                else:
+                    node = right[node]
+            leaves[i, t] = node
+    return leaves
+
+
+@functools.lru_cache(maxsize=None)
+def compiled_walk():
+    """The tree walk compiled with numba (loaded from numba's cache after the first run), or None without numba."""
+    try:
+        import numba
+    except ImportError:
+        return None
+    return numba.njit(cache=True, nogil=True)(_walk)
@@ -0,0 +1,243 @@
+"""Update a saved pipeline with a new slice of data instead of retraining it.
+
+When a new year of KSI data comes out, ``update_pipeline`` folds it into the
+fitted pipeline of ``ksi.pipeline`` looking only at the new rows:
+
+- the one hot vocabulary is extended with the categories seen for the first
+  time (``SparseOneHotEncoder.partial_fit``);
+- trees trained on the new rows only are added to the forest with
+  ``warm_start``. ``decay`` keeps only that share of the existing trees,
+  the most recently added, so old years fade out of the forest
+  geometrically.
+
+Rows with a category seen for the first time used to be counted in their
+column's OTHER indicator, so the new indicator starts with OTHER's loadings
+and those rows keep their features.
+
+The SVD components stay as they are by default. The existing trees split on
+the components they were trained on and only make sense on that basis:
+change the components under them and the same old rows get different
+features, and different predictions. ``update_components=True`` opts in to
+updating the TruncatedSVD from its own singular values and components - a
+rank ``k`` sketch of all the rows it has seen - stacked on the new rows, with
+a randomized SVD. The randomized SVD may return the components in another
+order, so each old component is paired with the new one it is closest to
+(a one to one assignment on absolute cosines) and keeps its sign. If a
+component the trees use turned further than ``min_cosine``, the update is
+refused unless ``decay=0`` drops every old tree.
+
+The features kept after feature selection stay as they are. Each update costs
+about as much as fitting on the new rows alone. ``drift_report`` compares an
+updated pipeline with a full retrain on the same held-out rows and, given the
+pipeline as it was before the update, how far the old trees' predictions
+moved.
+
+    python -m ksi.incremental ksi_model.joblib KSI_2018.csv --output ksi_model_2018.joblib
+"""
+import argparse
+import copy
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.optimize import linear_sum_assignment
+from sklearn.utils.extmath import randomized_svd
+
+from ksi.cleaning import group_categories
+from ksi.data import FLAG_COLUMNS, load_ksi
+from ksi.encoding import OTHER
+from ksi.metrics import INJURY_LABELS, evaluation_report
+from ksi.pipeline import MODEL_FILE, encode_target, forest_of, load_pipeline, save_pipeline
+
+RSEED = 42
+
+
+def expand_components(components, old_names, new_names, seeds=None):
+    """Components re-laid onto a grown feature list.
+
+    ``seeds`` maps new features to the old feature whose loadings they start
+    with; the other new features get zero loadings.
+    """
+    position = {name: i for i, name in enumerate(new_names)}
+    old_position = {name: i for i, name in enumerate(old_names)}
+    expanded = np.zeros((components.shape[0], len(new_names)), dtype=components.dtype)
+    expanded[:, [position[name] for name in old_names]] = components
+    for name, seed in (seeds or {}).items():
+        expanded[:, position[name]] = components[:, old_position[seed]]
+    return expanded
+
+
+def update_svd(svd, X_new, n_iter=7, random_state=RSEED):
+    """Update a fitted TruncatedSVD with new rows, in place.
+
+    Every old component is replaced by the new component closest to it, one
+    to one, with the same sign, so component numbers keep their meaning as
+    far as the data allows. Returns the absolute cosine of every updated
+    component with its previous direction - 1 means it didn't move; the
+    singular values follow the components. ``explained_variance_`` and
+    ``explained_variance_ratio_`` describe the new rows, the way TruncatedSVD
+    describes the rows it was last fitted on.
+    """
+    old_components = svd.components_
+    sketch = sp.vstack([sp.csr_matrix(svd.singular_values_[:, None] * old_components), sp.csr_matrix(X_new)],
+                       format='csr')
+    _, singular_values, components = randomized_svd(sketch, svd.n_components, n_iter=n_iter,
+                                                    random_state=random_state)
+    # cosines[i, j] is between new component i and old component j
+    cosines = components @ old_components.T
+    new, old = linear_sum_assignment(-np.abs(cosines))
+    order = new[np.argsort(old)]
+    cosines = cosines[order, np.arange(len(order))]
+    components = components[order] * np.where(cosines < 0, -1, 1)[:, None]
+    singular_values = singular_values[order]
+
+    svd.components_ = components
+    svd.singular_values_ = singular_values
+    projected = X_new @ components.T
+    svd.explained_variance_ = np.var(projected, axis=0)
+    column_variance = np.asarray(X_new.power(2).mean(axis=0) if sp.issparse(X_new) else (X_new ** 2).mean(axis=0))
+    column_variance -= np.asarray(X_new.mean(axis=0)) ** 2
+    svd.explained_variance_ratio_ = svd.explained_variance_ / column_variance.sum()
+    return np.abs(cosines)
+
+
+def add_trees(forest, X_new, y_new, n_estimators, decay=1.0):
+    """Add ``n_estimators`` trees fitted on the new rows to a fitted forest, in place.
+
+    With ``decay`` below 1, only that share of the existing trees - the most
+    recently added ones - is kept. Returns the number of trees dropped.
+    """
+    classes = np.unique(y_new)
+    if not np.array_equal(classes, forest.classes_):
+        raise ValueError('the new rows have classes %s but the forest was trained on %s - every class needs '
+                         'to be in both' % (list(classes), list(forest.classes_)))
+    n_old = len(forest.estimators_)
+    keep = n_old if decay >= 1 else int(round(n_old * decay))
+    forest.estimators_ = forest.estimators_[n_old - keep:]
+    forest.set_params(warm_start=True, n_estimators=keep + n_estimators)
+    try:
+        forest.fit(X_new, y_new)
+    finally:
+        forest.set_params(warm_start=False)
+    return n_old - keep
+
+
+def update_pipeline(pipeline, data, n_estimators=20, decay=1.0, update_components=False, min_cosine=0.95, n_iter=7,
+                    random_state=RSEED):
+    """Fold new raw KSI rows into a fitted pipeline from ``ksi.pipeline``, in place.
+
+    With ``update_components``, raises ``ValueError`` - leaving the pipeline
+    as it was - when a component the forest uses ends up less than
+    ``min_cosine`` from its previous direction and old trees would be kept.
+    Returns a dict describing the update: new one hot features, component
+    cosines, trees added and dropped, and the seconds it took.
+    """
+    start = time.perf_counter()
+    preprocessor = pipeline.named_steps['preprocess']
+    forest = forest_of(pipeline)
+    grouped = group_categories(data)
+
+    # Worked out on copies, so a refused update changes nothing
+    encoder = copy.deepcopy(preprocessor.encoder_)
+    svd = copy.deepcopy(preprocessor.svd_)
+    old_names = list(encoder.feature_names_)
+    encoder.partial_fit(grouped)
+    new_features = [name for name in encoder.feature_names_ if name not in set(old_names)]
+    if new_features:
+        # Until now these categories were encoded as their column's OTHER
+        seeds = {'%s_%s' % (column, category): '%s_%s' % (column, OTHER)
+                 for column, categories in zip(encoder.columns, encoder.categories_) for category in categories}
+        # The SVD sees the flags first, then the one hot columns
+        svd.components_ = expand_components(svd.components_, FLAG_COLUMNS + old_names,
+                                            FLAG_COLUMNS + encoder.feature_names_,
+                                            {name: seeds[name] for name in new_features})
+        svd.n_features_in_ = svd.components_.shape[1]
+
+    preprocessor.encoder_, old_encoder = encoder, preprocessor.encoder_
+    cosines = None
+    if update_components:
+        cosines = update_svd(svd, preprocessor._sparse_features(grouped), n_iter=n_iter, random_state=random_state)
+        used = [feature for feature in preprocessor.features_ if not isinstance(feature, str)]
+        turned = [component for component in used if cosines[component] < min_cosine]
+        if turned and decay > 0:
+            preprocessor.encoder_ = old_encoder
+            raise ValueError('components %s turned below a cosine of %g (down to %.3f); the existing trees were '
+                             'trained on the old components - keep them, or drop the old trees with decay=0'
+                             % (', '.join(map(str, turned)), min_cosine, min(cosines[turned])))
+    preprocessor.svd_ = svd
+
+    dropped = add_trees(forest, preprocessor.transform(data), encode_target(data).to_numpy(), n_estimators, decay)
+    return {
+        'rows': len(data),
+        'new_features': new_features,
+        'component_cosines': None if cosines is None else cosines.tolist(),
+        'trees_added': n_estimators,
+        'trees_dropped': dropped,
+        'trees': len(forest.estimators_),
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def drift_report(updated, retrained, data, original=None, class_names=INJURY_LABELS):
+    """Scores of an updated and a fully retrained pipeline on the same raw rows, and their difference.
+
+    The ``agreement`` row is the share of rows both pipelines predict the same.
+    Given the ``original`` pipeline - a copy taken before the update - the
+    ``old trees changed`` and ``old trees max shift`` rows are the share of
+    rows whose prediction by the original trees changes, and the largest
+    change of a probability, when they read the updated features instead of
+    the ones they were trained on. Both are 0 while the components are kept.
+    """
+    y = encode_target(data).to_numpy()
+    predictions = {name: pipeline.predict(data) for name, pipeline in
+                   [('updated', updated), ('retrained', retrained)]}
+    rows = {}
+    for name, predicted in predictions.items():
+        report = evaluation_report(y, predicted, class_names=class_names, n_resamples=0)
+        rows[name] = {'accuracy': report['accuracy']['value'],
+                      'macro f1': report['macro avg']['f1']['value'],
+                      **{'recall %s' % class_name: scores['recall']['value']
+                         for class_name, scores in report['classes'].items()}}
+    table = pd.DataFrame(rows)
+    table['drift'] = table['updated'] - table['retrained']
+    table.loc['agreement'] = [np.nan, np.nan, float(np.mean(predictions['updated'] == predictions['retrained']))]
+    if original is not None:
+        forest = forest_of(original)
+        before = forest.predict_proba(original.named_steps['preprocess'].transform(data))
+        after = forest.predict_proba(updated.named_steps['preprocess'].transform(data))
+        table.loc['old trees changed'] = [float(np.mean(before.argmax(axis=1) != after.argmax(axis=1))),
+                                          np.nan, np.nan]
+        table.loc['old trees max shift'] = [float(np.abs(after - before).max()), np.nan, np.nan]
+    return table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('model', help='saved pipeline to update')
+    parser.add_argument('input', help='CSV file of new raw KSI rows')
+    parser.add_argument('--output', default=MODEL_FILE, help='where to save the updated pipeline '
+                                                             '(default: %(default)s)')
+    parser.add_argument('--n-estimators', type=int, default=20, help='trees to add (default: %(default)s)')
+    parser.add_argument('--decay', type=float, default=1.0, help='share of the existing trees to keep '
+                                                                 '(default: %(default)s)')
+    parser.add_argument('--update-components', action='store_true',
+                        help='also update the SVD components the existing trees were trained on')
+    parser.add_argument('--min-cosine', type=float, default=0.95,
+                        help='refuse component updates turning a used component further than this, unless '
+                             '--decay is 0 (default: %(default)s)')
+    args = parser.parse_args(argv)
+    pipeline = load_pipeline(args.model)
+    update = update_pipeline(pipeline, load_ksi(args.input), n_estimators=args.n_estimators, decay=args.decay,
+                             update_components=args.update_components, min_cosine=args.min_cosine)
+    save_pipeline(pipeline, args.output)
+    print('%(rows)d rows, %(trees_added)d trees added, %(trees_dropped)d dropped, %(trees)d in the forest, '
+          '%(seconds).1fs' % update)
+    if update['new_features']:
+        print('new features:', ', '.join(update['new_features']))
+    if update['component_cosines'] is not None:
+        print('smallest component cosine: %.3f' % min(update['component_cosines']))
+
+
+if __name__ == '__main__':
+    main()
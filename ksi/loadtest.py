@@ -0,0 +1,82 @@
+"""Load test for the prediction service in ``ksi.serving``.
+
+Replays records from a KSI CSV against a running service from several
+concurrent clients and reports latency percentiles and throughput.
+
+    python -m ksi.serving ksi_model.joblib &
+    python -m ksi.loadtest KSI_CLEAN.csv --concurrency 8 --requests 20000
+"""
+import argparse
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+import pandas as pd
+
+
+def load_records(path, limit=10_000):
+    """Raw records as JSON-ready dicts."""
+    return pd.read_csv(path, nrows=limit, keep_default_na=False, na_values=['']).to_dict('records')
+
+
+def _client(url, payloads, latencies, errors):
+    parsed = urlparse(url)
+    connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80)
+    headers = {'Content-Type': 'application/json'}
+    for payload in payloads:
+        start = time.perf_counter()
+        connection.request('POST', parsed.path, payload, headers)
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.status != 200:
+            errors.append(response.status)
+    connection.close()
+
+
+def run_load_test(url, records, concurrency=8, n_requests=10_000, batch_size=1):
+    """Send ``n_requests`` requests of ``batch_size`` records, returning latency stats in ms."""
+    # bytes bodies go out in the same packet as the headers
+    payloads = [json.dumps({'records': [records[(i * batch_size + j) % len(records)] for j in range(batch_size)]})
+                .encode() for i in range(n_requests)]
+    latencies, errors = [], []
+    threads = [threading.Thread(target=_client, args=(url, payloads[i::concurrency], latencies, errors))
+               for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'concurrency': concurrency,
+        'batch_size': batch_size,
+        'requests_per_second': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p90_ms': float(np.percentile(latencies, 90)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'max_ms': float(latencies.max()),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the KSI prediction service.')
+    parser.add_argument('data', help='KSI CSV to take records from')
+    parser.add_argument('--url', default='http://127.0.0.1:8000/predict')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=10_000)
+    parser.add_argument('--batch-size', type=int, default=1, help='records per request')
+    args = parser.parse_args(argv)
+    report = run_load_test(args.url, load_records(args.data), args.concurrency, args.requests, args.batch_size)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""Reusable preprocessing + model pipeline for scoring new accident records.
+
+``KSIPreprocessor`` packages every step the analysis applies before training
+- the cleaning tables, the one hot vocabulary, the fitted TruncatedSVD and the
+features kept after feature selection - so a batch of raw KSI rows (as read
+by ``ksi.data``) can be transformed with the exact same steps. Put in front of
+the RandomForestClassifier it gives one sklearn ``Pipeline`` that is saved
+with joblib and scores raw rows in a single ``predict`` call.
+
+The random forest is one of several model backends (``BACKENDS``). The
+histogram gradient boosters - sklearn's HistGradientBoostingClassifier and
+LightGBM's LGBMClassifier - bin every feature into at most 255 values and
+split on categories directly, so ``CategoricalPreprocessor`` hands them each
+one hot column as a single categorical column instead of SVD components.
+"""
+import joblib
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.decomposition import TruncatedSVD
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
+from sklearn.pipeline import Pipeline
+
+from ksi.cleaning import ORDINAL_MAPS, encode_ordinal, encode_ordinals, group_categories
+from ksi.data import FLAG_COLUMNS
+from ksi.encoding import ONE_HOT_COLUMNS, SparseOneHotEncoder
+from ksi.features import assemble_features
+
+RSEED = 42
+
+MODEL_FILE = 'ksi_model.joblib'
+
+# Ordinal columns that go into the model as they are, next to the SVD components
+ORDINAL_FEATURES = ['WEEKDAY', 'ROAD_CLASS', 'VISIBILITY', 'LIGHT', 'RDSFCOND']
+
+# Features the notebook dropped after looking at the feature selection voting table -
+# strings are ordinal columns, integers are SVD components
+FEATURES_TO_DROP = [33, 28, 26, 'WEEKDAY', 'LIGHT', 'VISIBILITY', 'ROAD_CLASS', 'RDSFCOND', 2]
+
+# Models build_pipeline can train: the notebook's random forest on SVD components,
+# or a histogram gradient booster on the categorical columns
+BACKENDS = ['forest', 'hist', 'lightgbm']
+
+
+def encode_target(data):
+    """The INJURY target as ordinal levels 0 (none) to 3 (fatal)."""
+    return encode_ordinal(data['INJURY'], ORDINAL_MAPS['INJURY'])
+
+
+class KSIPreprocessor(BaseEstimator, TransformerMixin):
+    """Turn raw KSI rows into the model's feature matrix.
+
+    The flags and one hot indicators are projected onto ``n_components``
+    TruncatedSVD components; the ordinal columns pass through untouched.
+    ``features_`` lists the features that are kept after dropping
+    ``drop_features``, in output order.
+    """
+
+    def __init__(self, n_components=34, n_iter=7, random_state=RSEED, drop_features=FEATURES_TO_DROP):
+        self.n_components = n_components
+        self.n_iter = n_iter
+        self.random_state = random_state
+        self.drop_features = drop_features
+
+    @classmethod
+    def from_fitted(cls, encoder, svd, features):
+        """Build a fitted preprocessor from pieces fitted elsewhere, e.g. in the notebook."""
+        preprocessor = cls(n_components=svd.n_components, n_iter=svd.n_iter, random_state=svd.random_state,
+                           drop_features=[feature for feature in ORDINAL_FEATURES + list(range(svd.n_components))
+                                          if feature not in features])
+        preprocessor.encoder_ = encoder
+        preprocessor.svd_ = svd
+        preprocessor.features_ = list(features)
+        return preprocessor
+
+    def _sparse_features(self, data):
+        flags = sp.csr_matrix(data[FLAG_COLUMNS].to_numpy(dtype=np.float32))
+        return sp.hstack([flags, self.encoder_.transform(data)], format='csr', dtype=np.float32)
+
+    def fit(self, X, y=None):
+        data = group_categories(X)
+        self.encoder_ = SparseOneHotEncoder(ONE_HOT_COLUMNS).fit(data)
+        self.svd_ = TruncatedSVD(n_components=self.n_components, n_iter=self.n_iter,
+                                 random_state=self.random_state).fit(self._sparse_features(data))
+        self.features_ = [feature for feature in ORDINAL_FEATURES + list(range(self.n_components))
+                          if feature not in self.drop_features]
+        return self
+
+    def transform(self, X):
+        data = group_categories(X)
+        # Only the ordinal columns that survived feature selection get encoded
+        data = encode_ordinals(data, [feature for feature in self.features_
+                                      if isinstance(feature, str) and feature in ORDINAL_MAPS])
+        return assemble_features(data, self.svd_, self._sparse_features(data), self.features_).values
+
+    def get_feature_names_out(self, input_features=None):
+        return np.asarray([str(feature) for feature in self.features_], dtype=object)
+
+
+class CategoricalPreprocessor(BaseEstimator, TransformerMixin):
+    """Turn raw KSI rows into a DataFrame for models that split on categories natively.
+
+    The ordinal columns are encoded and the flags pass through, as for
+    ``KSIPreprocessor``. Every one hot column stays one ``category`` column
+    over the categories seen in ``fit``, new ones counted as ``OTHER`` (see
+    ``SparseOneHotEncoder``), which both boosters pick up as categorical.
+    """
+
+    def __init__(self, columns=ONE_HOT_COLUMNS):
+        self.columns = columns
+
+    def fit(self, X, y=None):
+        self.encoder_ = SparseOneHotEncoder(self.columns).fit(group_categories(X))
+        self.features_ = ORDINAL_FEATURES + FLAG_COLUMNS + list(self.columns)
+        return self
+
+    def transform(self, X):
+        data = group_categories(X)
+        frame = {column: encode_ordinal(data[column], ORDINAL_MAPS[column]).to_numpy() if column in ORDINAL_MAPS
+                 else data[column].to_numpy(dtype=np.int8) for column in ORDINAL_FEATURES}
+        frame.update({column: data[column].to_numpy(dtype=np.int8) for column in FLAG_COLUMNS})
+        frame.update({column: self.encoder_.categorical(data, position)
+                      for position, column in enumerate(self.encoder_.columns)})
+        return pd.DataFrame(frame)
+
+    def get_feature_names_out(self, input_features=None):
+        return np.asarray(self.features_, dtype=object)
+
+
+def build_model(backend='forest', n_estimators=100, n_jobs=None, random_state=RSEED):
+    """An unfitted model of ``backend``, one of ``BACKENDS``.
+
+    ``n_estimators`` is the number of trees of the forest, or of boosting
+    iterations. The boosters run their full ``n_estimators`` rather than
+    stopping early on a random validation split, which would put people of
+    the same accident on both sides.
+    """
+    if backend == 'forest':
+        return RandomForestClassifier(n_estimators=n_estimators, max_depth=10, n_jobs=n_jobs,
+                                      random_state=random_state)
+    if backend == 'hist':
+        return HistGradientBoostingClassifier(max_iter=n_estimators, categorical_features='from_dtype',
+                                              early_stopping=False, random_state=random_state)
+    if backend == 'lightgbm':
+        from lightgbm import LGBMClassifier
+        return LGBMClassifier(n_estimators=n_estimators, n_jobs=n_jobs, random_state=random_state, verbose=-1)
+    raise ValueError('unknown backend %r, expected one of %s' % (backend, ', '.join(BACKENDS)))
+
+
+def build_pipeline(preprocessor=None, model=None, backend='forest'):
+    """The preprocessing steps of ``backend`` followed by its model, by default the notebook's random forest."""
+    if preprocessor is None:
+        preprocessor = KSIPreprocessor() if backend == 'forest' else CategoricalPreprocessor()
+    return Pipeline([
+        ('preprocess', preprocessor),
+        ('model', model if model is not None else build_model(backend)),
+    ])
+
+
+def final_estimator(pipeline):
+    """The fitted model at the end of ``pipeline``, taken out of its decision rule if it has one."""
+    model = pipeline.steps[-1][1]
+    return model.estimator_ if hasattr(model, 'decide') else model
+
+
+def forest_of(pipeline):
+    """The random forest of a ``'forest'`` backend pipeline, for code that works on its trees and SVD.
+
+    Raises ``ValueError`` for the other backends.
+    """
+    model = final_estimator(pipeline)
+    if not (isinstance(model, RandomForestClassifier)
+            and isinstance(pipeline.named_steps['preprocess'], KSIPreprocessor)):
+        raise ValueError('only random forest pipelines are supported here, not %s' % type(model).__name__)
+    return model
+
+
+def decide(pipeline, probabilities):
+    """Predicted classes from ``pipeline.predict_proba`` rows, through its decision rule if it has one."""
+    model = pipeline.steps[-1][1]
+    if hasattr(model, 'decide'):
+        return model.decide(probabilities)
+    return pipeline.classes_.take(probabilities.argmax(axis=1))
+
+
+def save_pipeline(pipeline, path=MODEL_FILE):
+    joblib.dump(pipeline, path)
+    return path
+
+
+def load_pipeline(path=MODEL_FILE):
+    return joblib.load(path)
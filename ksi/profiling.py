@@ -0,0 +1,195 @@
+"""Stage-level timing and memory profile of a pipeline run.
+
+Wrap each stage of the pipeline in ``profiler.stage(name)``, or decorate the
+functions that implement it with ``profiler.profile(name)``, and every call
+records its wall time, CPU time, the process' peak RSS, the bytes allocated
+by Python (tracemalloc) and the shape of the data going in and out. Stages
+can be nested. ``save`` writes the run as JSON, and optionally as a Chrome
+trace (chrome://tracing, Perfetto, speedscope) and as collapsed stacks for
+flamegraph.pl.
+
+    profiler = Profiler()
+    with profiler.stage('load') as stage:
+        data = stage.output(load_ksi())
+    profiler.save('profile.json', trace_path='profile.trace.json')
+"""
+import contextlib
+import datetime
+import functools
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_bytes():
+    """Highest resident set size of this process so far, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _shape(data):
+    shape = getattr(data, 'shape', None)
+    return list(shape) if shape is not None else None
+
+
+class Stage:
+    """One timed call of a stage; ``output`` records the shape of its result."""
+
+    def __init__(self, name, path, data=None):
+        self.name = name
+        self.path = path
+        self.start = self.wall_seconds = self.cpu_seconds = None
+        self.peak_rss = self.peak_rss_growth = None
+        self.alloc_delta = None
+        self.alloc_peak = 0
+        self.shape_in = _shape(data)
+        self.shape_out = None
+        self._alloc_start = None
+
+    def output(self, data):
+        self.shape_out = _shape(data)
+        return data
+
+    def to_dict(self):
+        return {key: value for key, value in vars(self).items() if not key.startswith('_')}
+
+
+class Profiler:
+    """Collects the stages of one run.
+
+    ``trace_allocations`` runs tracemalloc during the stages, which makes code
+    doing many small allocations (fitting hundreds of small models, say) two
+    to three times slower; ``stage`` can turn it off for such stages, which
+    then only record times and RSS.
+    """
+
+    def __init__(self, trace_allocations=True):
+        self.trace_allocations = trace_allocations
+        self.started = datetime.datetime.now().isoformat(timespec='seconds')
+        self._origin = time.perf_counter()
+        self._open = []
+        self.stages = []
+
+    def _update_alloc_peaks(self):
+        # tracemalloc has one peak counter, reset at every stage entry, so fold it
+        # into every open stage before it is reset or read
+        current, peak = tracemalloc.get_traced_memory()
+        for stage in self._open:
+            if stage._alloc_start is not None:
+                stage.alloc_peak = max(stage.alloc_peak, peak - stage._alloc_start)
+        return current
+
+    @contextlib.contextmanager
+    def stage(self, name, data=None, trace_allocations=None):
+        """Time the block as stage ``name``; ``data`` is the stage's input.
+
+        ``trace_allocations`` overrides the profiler's setting for this stage;
+        stages nested in a traced stage are always traced.
+        """
+        path = ';'.join([stage.name for stage in self._open] + [name])
+        record = Stage(name, path, data)
+        if trace_allocations is None:
+            trace_allocations = self.trace_allocations
+        started_tracing = trace_allocations and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            self._update_alloc_peaks()
+            tracemalloc.reset_peak()
+            record._alloc_start = tracemalloc.get_traced_memory()[0]
+        rss_start = peak_rss_bytes()
+        self._open.append(record)
+        record.start = time.perf_counter() - self._origin
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record.wall_seconds = time.perf_counter() - self._origin - record.start
+            record.cpu_seconds = time.process_time() - cpu_start
+            if tracing:
+                record.alloc_delta = self._update_alloc_peaks() - record._alloc_start
+            else:
+                record.alloc_delta = record.alloc_peak = None
+            record.peak_rss = peak_rss_bytes()
+            record.peak_rss_growth = None if rss_start is None else record.peak_rss - rss_start
+            self._open.pop()
+            self.stages.append(record)
+            if started_tracing:
+                tracemalloc.stop()
+
+    def profile(self, name=None):
+        """Decorator recording every call of a function as a stage.
+
+        The first positional argument is taken as the stage's input and the
+        return value as its output.
+        """
+        def decorator(function):
+            stage_name = name or function.__name__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage_name, args[0] if args else None) as record:
+                    return record.output(function(*args, **kwargs))
+            return wrapper
+        return decorator
+
+    def to_dict(self):
+        return {
+            'started': self.started,
+            'pid': os.getpid(),
+            'python': sys.version.split()[0],
+            'stages': [stage.to_dict() for stage in sorted(self.stages, key=lambda stage: stage.start)],
+        }
+
+    def summary(self):
+        """Totals per stage (nested stages by their ``outer;inner`` path), slowest first."""
+        stages = pd.DataFrame([stage.to_dict() for stage in self.stages])
+        if stages.empty:
+            return stages
+        return (stages.groupby('path')
+                .agg(calls=('name', 'size'), wall_seconds=('wall_seconds', 'sum'), cpu_seconds=('cpu_seconds', 'sum'),
+                     alloc_peak=('alloc_peak', 'max'), peak_rss_growth=('peak_rss_growth', 'sum'))
+                .sort_values('wall_seconds', ascending=False))
+
+    def trace_events(self):
+        """The stages as Chrome trace 'complete' events (times in microseconds)."""
+        return [{
+            'name': stage.name, 'ph': 'X', 'pid': os.getpid(), 'tid': 0,
+            'ts': stage.start * 1e6, 'dur': stage.wall_seconds * 1e6,
+            'args': {key: value for key, value in stage.to_dict().items()
+                     if key not in ('name', 'path', 'start', 'wall_seconds')},
+        } for stage in self.stages]
+
+    def collapsed_stacks(self):
+        """Lines of ``stage;substage self-time-in-microseconds`` for flamegraph.pl."""
+        self_time = {}
+        for stage in self.stages:
+            self_time[stage.path] = self_time.get(stage.path, 0.0) + stage.wall_seconds
+            parent = stage.path.rpartition(';')[0]
+            if parent:
+                self_time[parent] = self_time.get(parent, 0.0) - stage.wall_seconds
+        return ['%s %d' % (path, max(0, round(seconds * 1e6))) for path, seconds in self_time.items()]
+
+    def save(self, path, trace_path=None, collapsed_path=None):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        if trace_path:
+            with open(trace_path, 'w') as f:
+                json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms'}, f)
+        if collapsed_path:
+            with open(collapsed_path, 'w') as f:
+                f.write('\n'.join(self.collapsed_stacks()) + '\n')
+        return path
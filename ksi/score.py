@@ -0,0 +1,138 @@
+"""Score large KSI exports in fixed-size chunks.
+
+Reads a CSV or Parquet file ``chunksize`` rows at a time, runs each chunk
+through a saved model and appends the class probabilities and predicted
+INJURY level to the output file as it goes, so memory stays bounded by the
+chunk size rather than the size of the input. The model is a compiled
+``.npz`` file (see ``ksi.compiled``), which scores without importing
+scikit-learn, or a joblib pipeline (see ``ksi.pipeline``).
+
+    python -m ksi score ksi_model.npz KSI_2018.csv predictions.csv
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+from ksi.compiled import COMPILED_MODEL_FILE, CompiledModel, is_compiled
+from ksi.data import READ_CSV_OPTIONS
+
+CHUNKSIZE = 100_000
+
+# Column names for the predicted probability of each INJURY level
+PROBABILITY_COLUMNS = {0: 'P_NONE', 1: 'P_MINOR', 2: 'P_MAJOR', 3: 'P_FATAL'}
+
+# Input columns copied to the output so predictions can be joined back
+ID_COLUMNS = ['ACCNUM']
+
+
+def _is_parquet(path):
+    return os.path.splitext(str(path))[1].lower() in ('.parquet', '.pq')
+
+
+def read_chunks(path, chunksize=CHUNKSIZE):
+    """Yield DataFrames of at most ``chunksize`` rows from a CSV or Parquet file."""
+    if _is_parquet(path):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize, **READ_CSV_OPTIONS)
+
+
+class ChunkWriter:
+    """Append DataFrames to a CSV or Parquet file, one chunk at a time."""
+
+    def __init__(self, path):
+        self.path = path
+        self._parquet_writer = None
+        self._first = True
+
+    def write(self, frame):
+        if _is_parquet(self.path):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            self._parquet_writer.write_table(table)
+        else:
+            frame.to_csv(self.path, mode='w' if self._first else 'a', header=self._first, index=False)
+        self._first = False
+
+    def close(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def load_model(path, n_jobs=-1):
+    """A compiled model, or a joblib pipeline with its forest using ``n_jobs`` cores."""
+    if is_compiled(path):
+        return CompiledModel.load(path)
+    # Only joblib pipelines need scikit-learn
+    from ksi.pipeline import final_estimator, load_pipeline
+    pipeline = load_pipeline(path)
+    model = final_estimator(pipeline)
+    if hasattr(model, 'n_jobs'):
+        model.n_jobs = n_jobs
+    return pipeline
+
+
+def _decide(model, probabilities):
+    if hasattr(model, 'decide'):
+        return model.decide(probabilities)
+    from ksi.pipeline import decide
+    return decide(model, probabilities)
+
+
+def score_chunk(model, chunk):
+    """Predicted probabilities and INJURY level for one chunk of raw rows."""
+    probabilities = model.predict_proba(chunk)
+    classes = model.classes_
+    scored = pd.DataFrame(probabilities, columns=[PROBABILITY_COLUMNS.get(c, 'P_%s' % c) for c in classes])
+    # The same decision as predict(), without a second pass over the forest
+    scored['PREDICTION'] = _decide(model, probabilities)
+    for column in reversed(ID_COLUMNS):
+        if column in chunk.columns:
+            scored.insert(0, column, chunk[column].to_numpy())
+    return scored
+
+
+def score_file(model_path, input_path, output_path, chunksize=CHUNKSIZE, n_jobs=-1, log=sys.stderr):
+    """Score ``input_path`` into ``output_path``, returning the number of rows scored."""
+    model = load_model(model_path, n_jobs=n_jobs)
+
+    rows = 0
+    start = time.perf_counter()
+    with ChunkWriter(output_path) as writer:
+        for chunk in read_chunks(input_path, chunksize):
+            writer.write(score_chunk(model, chunk))
+            rows += len(chunk)
+            elapsed = time.perf_counter() - start
+            if log is not None:
+                print('%d rows scored, %.0f rows/s' % (rows, rows / elapsed), file=log)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('model', nargs='?', default=COMPILED_MODEL_FILE,
+                        help='compiled model (.npz) or joblib pipeline (default: %(default)s)')
+    parser.add_argument('input', help='CSV or Parquet file of raw KSI rows')
+    parser.add_argument('output', help='CSV or Parquet file to write predictions to')
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE, help='rows per chunk (default: %(default)s)')
+    parser.add_argument('--n-jobs', type=int, default=-1, help='cores used by a joblib pipeline\'s forest (default: all)')
+    args = parser.parse_args(argv)
+    score_file(args.model, args.input, args.output, chunksize=args.chunksize, n_jobs=args.n_jobs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Feature selection voting table.
+
+Five selectors each vote for ``num_feats`` features: Pearson correlation with
+the target, RFE over a logistic regression, and SelectFromModel over an L1
+logistic regression, a random forest and LightGBM. The correlations of all
+columns are computed in one matrix operation, the four model based selectors
+run at the same time in worker processes sharing one memory-mapped copy of
+the data, and with ``cache_dir`` every selector's result is cached on disk
+keyed by a hash of the data, so a rerun on unchanged data doesn't refit
+anything.
+"""
+import numpy as np
+import pandas as pd
+from joblib import Memory, Parallel, delayed
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_selection import RFE, SelectFromModel
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import MinMaxScaler
+
+from ksi.validation import memmapped
+
+SELECTORS = ['Pearson', 'RFE', 'Logistic Regression', 'Random Forest', 'LightGBM']
+
+
+def pearson_correlations(X, y):
+    """Pearson correlation of every column of ``X`` with ``y``; 0 for constant columns."""
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    X_centered = X - X.mean(axis=0)
+    y_centered = y - y.mean()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        correlations = (X_centered.T @ y_centered) / (np.sqrt((X_centered ** 2).sum(axis=0)) *
+                                                      np.sqrt((y_centered ** 2).sum()))
+    return np.nan_to_num(correlations, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def pearson_support(X, y, num_feats):
+    support = np.zeros(X.shape[1], dtype=bool)
+    support[np.argsort(np.abs(pearson_correlations(X, y)))[-num_feats:]] = True
+    return support
+
+
+def model_support(name, X, y, num_feats):
+    """Support mask of one of the model based selectors."""
+    if name == 'RFE':
+        selector = RFE(estimator=LogisticRegression(), n_features_to_select=num_feats, step=15)
+        return selector.fit(MinMaxScaler().fit_transform(X), y).get_support()
+    if name == 'Logistic Regression':
+        model = LogisticRegression(penalty='l1', solver='liblinear', max_iter=10000)
+    elif name == 'Random Forest':
+        model = RandomForestClassifier(n_estimators=40, bootstrap=False, max_features=num_feats)
+    elif name == 'LightGBM':
+        from lightgbm import LGBMClassifier
+        model = LGBMClassifier(n_estimators=500, learning_rate=0.05, num_leaves=32, colsample_bytree=0.2,
+                               reg_alpha=3, reg_lambda=1, min_split_gain=0.01, min_child_weight=40)
+    else:
+        raise ValueError('unknown selector %r' % name)
+    # The random forest is only limited by its importance threshold, as in the notebook
+    max_features = None if name == 'Random Forest' else num_feats
+    return SelectFromModel(model, max_features=max_features).fit(X, y).get_support()
+
+
+def _feature_key(feature):
+    # Feature names mix SVD component numbers and column names, which don't compare with each other -
+    # sorted in descending order, names come before component numbers with the same number of votes
+    return (0, feature, '') if isinstance(feature, (int, np.integer)) else (1, 0, str(feature))
+
+
+def feature_selection_table(X, y, num_feats=30, feature_names=None, n_jobs=-1, cache_dir=None):
+    """Votes of every selector per feature, most voted first.
+
+    Returns a DataFrame with a ``Feature`` column, one boolean column per
+    selector in ``SELECTORS`` and their ``Total``, indexed from 1.
+    """
+    if feature_names is None:
+        feature_names = list(X.columns) if hasattr(X, 'columns') else list(range(X.shape[1]))
+    # float32, like the feature matrix (see ksi.features), so a FeatureMatrix's values are used as they are
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    y = np.asarray(y)
+    memory = Memory(cache_dir, verbose=0)
+
+    models = SELECTORS[1:]
+    with memmapped(X, y) as (X_shared, y_shared):
+        supports = Parallel(n_jobs=n_jobs)(
+            delayed(memory.cache(model_support))(name, X_shared, y_shared, num_feats) for name in models)
+    supports = dict(zip(models, supports))
+    supports['Pearson'] = memory.cache(pearson_support)(X, y, num_feats)
+
+    table = pd.DataFrame({'Feature': feature_names, **{name: supports[name] for name in SELECTORS}})
+    table['Total'] = table[SELECTORS].sum(axis=1)
+    order = sorted(range(len(table)), key=lambda i: (table['Total'].iat[i], _feature_key(table['Feature'].iat[i])),
+                   reverse=True)
+    table = table.iloc[order]
+    table.index = range(1, len(table) + 1)
+    return table
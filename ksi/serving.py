@@ -0,0 +1,176 @@
+"""Low-latency HTTP prediction service for single accident records.
+
+Going through pandas and sklearn costs milliseconds per call even for one
+row, so the service compiles a saved pipeline (see ``ksi.pipeline``) into
+plain lookups instead: ``ksi.compiled.CompiledModel.transform_records`` turns
+raw record dicts into the model's feature rows - the same float32 features
+as the pipeline's - and ``ksi.forest.FlatForest`` evaluates the trees.
+Concurrent requests are micro-batched so the forest is walked once for all
+records that are waiting while the previous batch is scored.
+
+    python -m ksi.serving ksi_model.joblib --port 8000
+
+    POST /predict  {"records": [{"INVTYPE": "Driver", ...}, ...]}
+                -> {"predictions": [...], "probabilities": [[...], ...]}
+"""
+import argparse
+import json
+import queue
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ksi.compiled import CompiledModel
+from ksi.pipeline import MODEL_FILE, load_pipeline
+
+# Seconds a request waits for its batch to be scored before it is answered with a 503
+RESULT_TIMEOUT = 30.0
+
+
+class Scorer:
+    """Compiled preprocessing + forest of a saved pipeline."""
+
+    def __init__(self, pipeline):
+        # A long running server pays for loading numba once and keeps the faster walk
+        self.model = CompiledModel.from_pipeline(pipeline, compiled=True)
+        self.classes_ = self.model.classes_
+
+    def predict_proba(self, records):
+        return self.model.forest.predict_proba(self.model.transform_records(records))
+
+    def decide(self, probabilities):
+        """Predicted classes, through the pipeline's decision rule if it has one."""
+        return self.model.decide(probabilities)
+
+
+class MicroBatcher:
+    """Collect records from concurrent callers and score them together.
+
+    A worker thread waits for the first request, then also takes every request
+    already queued behind it - waiting up to ``max_wait`` seconds for more when
+    it is non-zero - up to ``max_batch`` records, and scores them in one call.
+    Requests that arrive while a batch is being scored form the next batch.
+    ``submit`` returns a Future of the probability rows, or of the error that
+    scoring them raised.
+    """
+
+    def __init__(self, scorer, max_batch=256, max_wait=0.0):
+        self.scorer = scorer
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def submit(self, records):
+        if not isinstance(records, list):
+            raise TypeError('records must be a list, not %s' % type(records).__name__)
+        future = Future()
+        self._queue.put((records, future))
+        return future
+
+    def _take_batch(self, batch):
+        batch.append(self._queue.get())
+        size = len(batch[0][0])
+        while size < self.max_batch:
+            try:
+                item = self._queue.get(timeout=self.max_wait) if self.max_wait else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+
+    def _run(self):
+        while True:
+            # Requests taken so far stay in batch, so an error while taking them fails them too
+            batch = []
+            try:
+                self._take_batch(batch)
+                self._score(batch)
+            except Exception as error:
+                # The worker is the only one - fail this batch's requests rather than every later one
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+
+    def _score(self, batch):
+        records = [record for request, _ in batch for record in request]
+        try:
+            probabilities = self.scorer.predict_proba(records)
+        except Exception:
+            # One bad record shouldn't fail the whole batch - score requests one by one
+            for request, future in batch:
+                try:
+                    future.set_result(self.scorer.predict_proba(request))
+                except Exception as error:
+                    future.set_exception(error)
+            return
+        start = 0
+        for request, future in batch:
+            future.set_result(probabilities[start:start + len(request)])
+            start += len(request)
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Small responses otherwise sit in the kernel waiting for a delayed ACK (~40ms)
+    disable_nagle_algorithm = True
+    batcher = None
+
+    def _reply(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        if self.path != '/predict':
+            return self._reply(404, {'error': 'unknown path %s' % self.path})
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            records = body['records'] if isinstance(body, dict) and 'records' in body else [body]
+            if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+                raise TypeError('records must be a list of objects')
+            probabilities = self.batcher.submit(records).result(timeout=RESULT_TIMEOUT)
+        except (ValueError, KeyError, TypeError) as error:
+            return self._reply(400, {'error': '%s: %s' % (type(error).__name__, error)})
+        except TimeoutError:
+            return self._reply(503, {'error': 'scoring took longer than %gs' % RESULT_TIMEOUT})
+        except Exception as error:
+            # Anything else is our fault, not the request's - answer rather than drop the connection
+            return self._reply(500, {'error': '%s: %s' % (type(error).__name__, error)})
+        self._reply(200, {
+            'predictions': self.batcher.scorer.decide(probabilities).tolist(),
+            'probabilities': probabilities.tolist(),
+        })
+
+    def log_message(self, format, *args):
+        # Logging every request to stderr costs more than scoring it
+        pass
+
+
+def make_server(pipeline, host='127.0.0.1', port=8000, max_batch=256, max_wait=0.0):
+    handler = type('Handler', (PredictionHandler,), {
+        'batcher': MicroBatcher(Scorer(pipeline), max_batch=max_batch, max_wait=max_wait),
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve INJURY predictions over HTTP.')
+    parser.add_argument('model', nargs='?', default=MODEL_FILE, help='saved pipeline (default: %(default)s)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch', type=int, default=256, help='most records scored together')
+    parser.add_argument('--max-wait', type=float, default=0.0,
+                        help='seconds to wait for more records before scoring a batch')
+    args = parser.parse_args(argv)
+    server = make_server(load_pipeline(args.model), args.host, args.port, args.max_batch, args.max_wait)
+    print('Serving %s on http://%s:%d/predict' % (args.model, args.host, args.port))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+"""Synthetic KSI records at any scale, for benchmarks.
+
+``generate_ksi`` draws rows with the columns and dtypes of KSI_CLEAN.csv.
+Every text column is drawn from ``DISTRIBUTIONS``, the approximate value
+frequencies of the real file, and every flag from ``FLAG_RATES``. Accidents
+are generated first and then one row per involved person, so accident level
+columns (date, place, road conditions, flags) repeat within an ``ACCNUM`` the
+way they do in the real data, ``PEDESTRIAN``/``CYCLIST`` follow the impact
+type, and ``ACCLASS``/``FATAL`` mark accidents with a fatal injury.
+
+Columns are drawn independently of each other otherwise, so a model trained
+on synthetic rows learns next to nothing - they are for timing the pipeline,
+not for judging it. ``fit_distributions`` reads the frequencies off the real
+dataset when it is at hand.
+
+    python -m ksi.synthetic 1000000 ksi_1m.csv
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from ksi.data import CATEGORICAL_COLUMNS, DTYPES, FLAG_COLUMNS
+
+RSEED = 42
+
+# Column order of KSI_CLEAN.csv
+COLUMNS = ['ACCNUM', 'YEAR', 'MONTH', 'DAY', 'HOUR', 'MINUTES', 'WEEKDAY', 'LATITUDE', 'LONGITUDE',
+           'Ward_Name', 'Ward_ID', 'Hood_Name', 'Hood_ID', 'Division', 'District', 'STREET1', 'STREET2',
+           'OFFSET', 'ROAD_CLASS', 'LOCCOORD', 'ACCLOC', 'TRAFFCTL', 'VISIBILITY', 'LIGHT', 'RDSFCOND',
+           'ACCLASS', 'IMPACTYPE', 'INVTYPE', 'INVAGE', 'INJURY', 'FATAL_NO', 'INITDIR', 'VEHTYPE',
+           'MANOEUVER', 'DRIVACT', 'DRIVCOND', 'PEDTYPE', 'PEDACT', 'PEDCOND', 'CYCLISTYPE', 'CYCACT',
+           'CYCCOND'] + FLAG_COLUMNS
+
+# Columns describing the person rather than the accident
+PERSON_COLUMNS = ['INVTYPE', 'INVAGE', 'INJURY', 'INITDIR', 'VEHTYPE', 'MANOEUVER', 'DRIVACT', 'DRIVCOND',
+                  'PEDTYPE', 'PEDACT', 'PEDCOND', 'CYCLISTYPE', 'CYCACT', 'CYCCOND']
+
+# Average number of people (rows) per accident
+PERSONS_PER_ACCIDENT = 2.3
+
+FIRST_DAY, LAST_DAY = np.datetime64('2007-01-01'), np.datetime64('2017-12-31')
+
+# Accidents per hour of the day, relative
+HOUR_WEIGHTS = [3, 2, 2, 1.5, 1, 1, 2, 4, 5, 4, 4, 4.5, 5, 5, 5.5, 6.5, 7, 7, 6.5, 5.5, 5, 4.5, 4, 3.5]
+
+TORONTO = (43.705, -79.40)
+
+STREETS = ['YONGE ST', 'BLOOR ST W', 'QUEEN ST W', 'KING ST W', 'DUNDAS ST W', 'EGLINTON AVE E', 'FINCH AVE W',
+           'SHEPPARD AVE E', 'STEELES AVE E', 'LAWRENCE AVE E', 'KINGSTON RD', 'DANFORTH AVE', 'JANE ST',
+           'KEELE ST', 'BATHURST ST', 'DON MILLS RD', 'VICTORIA PARK AVE', 'KENNEDY RD', 'ISLINGTON AVE',
+           'SPADINA AVE']
+
+# Approximate relative frequencies of the values of every text column in KSI_CLEAN.csv. The ordinal
+# columns only use the levels ksi.cleaning.ORDINAL_MAPS knows
+DISTRIBUTIONS = {
+    'Division': {'D%d' % division: 1 for division in [11, 12, 13, 14, 22, 23, 31, 32, 33, 41, 42, 43, 51, 52, 53,
+                                                      54, 55]},
+    'District': {'Toronto and East York': 38, 'Etobicoke York': 19, 'North York': 21, 'Scarborough': 22},
+    'STREET1': dict.fromkeys(STREETS, 1),
+    'STREET2': {**dict.fromkeys(STREETS, 1), ' ': 2},
+    'OFFSET': {' ': 80, '10 m West of': 4, '10 m East of': 4, '20 m North of': 4, '20 m South of': 4,
+               '50 m West of': 2, '50 m East of': 2},
+    'ROAD_CLASS': {'Major Arterial': 70, 'Minor Arterial': 15, 'Collector': 5.5, 'Local': 7, 'Expressway': 0.8,
+                   'Expressway Ramp': 0.2, 'Major Arterial Ramp': 0.1, 'Laneway': 0.1},
+    'LOCCOORD': {'Intersection': 63, 'Mid-Block': 36, ' ': 0.5, 'Park, Private Property, Public Lane': 0.3,
+                 'Entrance Ramp Westbound': 0.1, 'Exit Ramp Southbound': 0.1},
+    'ACCLOC': {'At Intersection': 47, ' ': 28, 'Non Intersection': 13, 'Intersection Related': 8,
+               'At/Near Private Drive': 2, 'Laneway': 0.5, 'Private Driveway': 0.3, 'Overpass or Bridge': 0.3,
+               'Underpass or Tunnel': 0.1},
+    'TRAFFCTL': {'No Control': 48, 'Traffic Signal': 42, 'Stop Sign': 7, 'Pedestrian Crossover': 1.3,
+                 'Traffic Controller': 0.6, ' ': 0.5, 'Yield Sign': 0.1, 'School Guard': 0.1,
+                 'Streetcar (Stop for)': 0.1, 'Traffic Gate': 0.05, 'Police Control': 0.05},
+    'VISIBILITY': {'Clear': 86, 'Rain': 10.5, 'Snow': 2, 'Other': 0.5, 'Freezing Rain': 0.5, 'Drifting Snow': 0.3,
+                   'Fog, Mist, Smoke, Dust': 0.3, 'Strong wind': 0.1, ' ': 0.1},
+    'LIGHT': {'Daylight': 57, 'Dark': 19, 'Dark, artificial': 17, 'Dusk': 1.5, 'Dusk, artificial': 1.5,
+              'Daylight, artificial': 0.8, 'Dawn': 0.7, 'Dawn, artificial': 0.7, 'Other': 0.1},
+    'RDSFCOND': {'Dry': 80, 'Wet': 16.5, 'Slush': 0.8, 'Loose Snow': 0.6, 'Ice': 0.6, 'Other': 0.6,
+                 'Packed Snow': 0.2, 'Loose Sand or Gravel': 0.1, ' ': 0.1, 'Spilled liquid': 0.02},
+    'IMPACTYPE': {'Pedestrian Collisions': 40, 'Turning Movement': 15, 'Cyclist Collisions': 9, 'Rear End': 8,
+                  'SMV Other': 7, 'Angle': 7, 'Approaching': 3, 'Sideswipe': 3, 'Other': 1,
+                  'SMV Unattended Vehicle': 0.5},
+    'INVTYPE': {'Driver': 44, 'Pedestrian': 17, 'Passenger': 15, 'Vehicle Owner': 11, 'Cyclist': 4.5,
+                'Motorcycle Driver': 3, 'Truck Driver': 1.5, 'Other Property Owner': 1.5, 'Driver - Not Hit': 0.5,
+                'Other': 0.5, ' ': 0.3, 'Motorcycle Passenger': 0.2, 'Moped Driver': 0.2, 'Wheelchair': 0.1,
+                'Pedestrian - Not Hit': 0.05, 'Trailer Owner': 0.05, 'Witness': 0.05, 'In-Line Skater': 0.03,
+                'Runaway - No Driver': 0.02, 'Unknown - FTR': 0.02, 'Cyclist Passenger': 0.02},
+    'INVAGE': {'0 to 4': 0.8, '5 to 9': 1.2, '10 to 14': 2, '15 to 19': 5, '20 to 24': 8, '25 to 29': 8.5,
+               '30 to 34': 8, '35 to 39': 7.5, '40 to 44': 7.5, '45 to 49': 7.5, '50 to 54': 7, '55 to 59': 6,
+               '60 to 64': 5, '65 to 69': 4, '70 to 74': 3, '75 to 79': 2.5, '80 to 84': 2, '85 to 89': 1,
+               '90 to 94': 0.3, 'Over 95': 0.1, 'unknown': 8},
+    'INJURY': {'None': 36, 'Major': 33, ' ': 10, 'Minor': 9, 'Minimal': 6, 'Fatal': 5},
+    'INITDIR': {' ': 28, 'North': 18, 'South': 18, 'East': 18, 'West': 18, 'Unknown': 0.5},
+    'VEHTYPE': {'Automobile, Station Wagon': 43, ' ': 31, 'Other': 9, 'Bicycle': 4, 'Motorcycle': 3,
+                'Municipal Transit Bus (TTC)': 1.5, 'Pick Up Truck': 1, 'Passenger Van': 1, 'Taxi': 1,
+                'Truck - Closed (Blazer, etc)': 0.6, 'Truck - Open': 0.5, 'Delivery Van': 0.5, 'Street Car': 0.5,
+                'Truck-Tractor': 0.4, 'Truck - Dump': 0.3, 'Police Vehicle': 0.2, 'Moped': 0.2,
+                'Bus (Other) (Go Bus, Gray Coach)': 0.2, 'Truck (other)': 0.2, 'Intercity Bus': 0.1,
+                'School Bus': 0.05, 'Tow Truck': 0.05, 'Construction Equipment': 0.05, 'Fire Vehicle': 0.03,
+                'Off Road - 2 Wheels': 0.03, 'Truck - Tank': 0.03, 'Truck - Car Carrier': 0.02,
+                'Other Emergency Vehicle': 0.02},
+    'MANOEUVER': {' ': 42, 'Going Ahead': 35, 'Turning Left': 10, 'Stopped': 3, 'Turning Right': 3, 'Other': 1,
+                  'Slowing or Stopping': 1, 'Changing Lanes': 1, 'Reversing': 0.5, 'Parked': 0.5,
+                  'Overtaking': 0.5, 'Making U Turn': 0.3},
+    'DRIVACT': {' ': 50, 'Driving Properly': 25, 'Failed to Yield Right of Way': 10, 'Lost control': 3,
+                'Disobeyed Traffic Control': 3, 'Improper Turn': 2, 'Other': 2, 'Exceeding Speed Limit': 1.5,
+                'Following too Close': 1, 'Speed too Fast For Condition': 1, 'Improper Passing': 0.5,
+                'Improper Lane Change': 0.5, 'Wrong Way on One Way Road': 0.1},
+    'DRIVCOND': {' ': 50, 'Normal': 28, 'Inattentive': 9, 'Unknown': 7, 'Had Been Drinking': 1,
+                 'Ability Impaired, Alcohol Over .08': 0.8, 'Other': 0.5, 'Medical or Physical Disability': 0.3,
+                 'Ability Impaired, Alcohol': 0.3, 'Fatigue': 0.2, 'Ability Impaired, Drugs': 0.2},
+    'PEDTYPE': {' ': 83, 'Pedestrian hit at mid-block': 4,
+                'Vehicle turns left while ped crosses with ROW at inter.': 4,
+                'Vehicle is going straight thru inter.while ped cross without ROW': 2, 'Other / Undefined': 2,
+                'Vehicle turns right while ped crosses with ROW at inter.': 1.5,
+                'Pedestrian hit a PXO/ped. Mid-block signal': 0.5, 'Vehicle is reversing and hits pedestrian': 0.5,
+                'Pedestrian hit on sidewalk or shoulder': 0.4, 'Pedestrian hit at private driveway': 0.3},
+    'PEDACT': {' ': 83, 'Crossing with right of way': 6, 'Crossing without right of way': 3,
+               'Crossing, no Traffic Control': 3, 'Other': 2, 'Crossing, Pedestrian Crossover': 0.7,
+               'On Sidewalk or Shoulder': 0.5, 'Running onto Roadway': 0.5,
+               'Coming From Behind Parked Vehicle': 0.3, 'Walking on Roadway Against Traffic': 0.2,
+               'Walking on Roadway with Traffic': 0.2, 'Playing or Working on Highway': 0.1},
+    'PEDCOND': {' ': 83, 'Normal': 9, 'Inattentive': 3, 'Unknown': 3, 'Had Been Drinking': 0.6,
+                'Medical or Physical Disability': 0.4, 'Other': 0.3, 'Ability Impaired, Alcohol': 0.2},
+    'CYCLISTYPE': {' ': 96, 'Cyclist without ROW rides into path of motorist at inter, lnwy, dwy-Cyclist not turn.': 0.6,
+                   'Other': 0.6, 'Motorist turned left across cyclists path.': 0.5,
+                   'Cyclist and Driver travelling in same direction. One vehicle rear-ended the other.': 0.5,
+                   'Cyclist struck opened vehicle door': 0.4,
+                   'Motorist turning right on red at signalized intersection (intersecting path).': 0.3},
+    'CYCACT': {' ': 96, 'Driving Properly': 2, 'Other': 0.6, 'Failed to Yield Right of Way': 0.5,
+               'Disobeyed Traffic Control': 0.5, 'Lost control': 0.2, 'Improper Turn': 0.2},
+    'CYCCOND': {' ': 96, 'Normal': 2.5, 'Inattentive': 0.7, 'Unknown': 0.5, 'Other': 0.2, 'Had Been Drinking': 0.1},
+}
+
+# Share of accidents with each flag set. PEDESTRIAN and CYCLIST follow IMPACTYPE and FATAL follows INJURY
+FLAG_RATES = {'AUTOMOBILE': 0.9, 'MOTORCYCLE': 0.08, 'TRUCK': 0.06, 'TRSN_CITY_VEH': 0.06, 'EMERG_VEH': 0.002,
+              'PASSENGER': 0.37, 'SPEEDING': 0.13, 'AG_DRIV': 0.51, 'REDLIGHT': 0.08, 'ALCOHOL': 0.04,
+              'DISABILITY': 0.03}
+
+N_WARDS, N_HOODS = 44, 140
+
+
+def fit_distributions(data):
+    """``DISTRIBUTIONS`` and ``FLAG_RATES`` as observed in a real KSI DataFrame."""
+    distributions = {column: data[column].value_counts().loc[lambda counts: counts > 0].to_dict()
+                     for column in DISTRIBUTIONS}
+    flag_rates = {column: float(data[column].mean()) for column in FLAG_RATES}
+    return distributions, flag_rates
+
+
+def _draw(rng, frequencies, size):
+    """Categorical of ``size`` values drawn with the relative ``frequencies``."""
+    values = list(frequencies)
+    weights = np.asarray([frequencies[value] for value in values], dtype=np.float64)
+    codes = rng.choice(len(values), size=size, p=weights / weights.sum()).astype(np.int16)
+    return pd.Categorical.from_codes(codes, pd.Index(values, dtype=object))
+
+
+def _numbered(rng, name, count, size):
+    """Names like ``Ward 7 (7)`` with their matching IDs."""
+    ids = rng.integers(1, count + 1, size=size).astype(np.int16)
+    names = pd.Index(['%s %d (%d)' % (name, number, number) for number in range(1, count + 1)], dtype=object)
+    return pd.Categorical.from_codes(ids - 1, names), ids
+
+
+def generate_ksi(n_rows, random_state=RSEED, distributions=None, flag_rates=None, first_accnum=1_000_000_000):
+    """A DataFrame of ``n_rows`` synthetic KSI rows, typed like ``ksi.data.load_ksi``."""
+    rng = np.random.default_rng(random_state)
+    distributions = DISTRIBUTIONS if distributions is None else distributions
+    flag_rates = FLAG_RATES if flag_rates is None else flag_rates
+
+    # People per accident, until there are enough rows; the last accident may lose a few people
+    sizes = rng.geometric(1 / PERSONS_PER_ACCIDENT, size=int(n_rows / PERSONS_PER_ACCIDENT) + 16)
+    while sizes.sum() < n_rows:
+        sizes = np.concatenate([sizes, rng.geometric(1 / PERSONS_PER_ACCIDENT, size=len(sizes))])
+    n_accidents = int(np.searchsorted(np.cumsum(sizes), n_rows)) + 1
+    sizes = sizes[:n_accidents]
+    sizes[-1] -= sizes.sum() - n_rows
+    accident = np.repeat(np.arange(n_accidents), sizes)
+
+    days = FIRST_DAY + rng.integers(0, (LAST_DAY - FIRST_DAY).astype(int) + 1, size=n_accidents)
+    hours = np.asarray(HOUR_WEIGHTS)
+    accidents = {
+        'ACCNUM': first_accnum + np.arange(n_accidents, dtype=np.int64),
+        'YEAR': days.astype('datetime64[Y]').astype(int) + 1970,
+        'MONTH': days.astype('datetime64[M]').astype(int) % 12 + 1,
+        'DAY': (days - days.astype('datetime64[M]')).astype(int) + 1,
+        'HOUR': rng.choice(24, size=n_accidents, p=hours / hours.sum()),
+        'MINUTES': rng.integers(0, 60, size=n_accidents),
+        # 1970-01-01 was a Thursday; Monday is 0
+        'WEEKDAY': (days.astype(int) + 3) % 7,
+        'LATITUDE': np.clip(rng.normal(TORONTO[0], 0.06, size=n_accidents), 43.58, 43.86),
+        'LONGITUDE': np.clip(rng.normal(TORONTO[1], 0.11, size=n_accidents), -79.64, -79.11),
+    }
+    accidents['Ward_Name'], accidents['Ward_ID'] = _numbered(rng, 'Ward', N_WARDS, n_accidents)
+    accidents['Hood_Name'], accidents['Hood_ID'] = _numbered(rng, 'Neighbourhood', N_HOODS, n_accidents)
+    for column, frequencies in distributions.items():
+        if column not in PERSON_COLUMNS:
+            accidents[column] = _draw(rng, frequencies, n_accidents)
+    for column, rate in flag_rates.items():
+        accidents[column] = (rng.random(n_accidents) < rate).astype(np.int8)
+    accidents['PEDESTRIAN'] = (np.asarray(accidents['IMPACTYPE']) == 'Pedestrian Collisions').astype(np.int8)
+    accidents['CYCLIST'] = (np.asarray(accidents['IMPACTYPE']) == 'Cyclist Collisions').astype(np.int8)
+
+    columns = {column: values.take(accident) if isinstance(values, pd.Categorical) else values[accident]
+               for column, values in accidents.items()}
+    for column in PERSON_COLUMNS:
+        columns[column] = _draw(rng, distributions[column], n_rows)
+
+    # An accident is fatal when anyone in it died
+    fatal = np.asarray(columns['INJURY']) == 'Fatal'
+    fatal_accident = np.zeros(n_accidents, dtype=bool)
+    np.logical_or.at(fatal_accident, accident, fatal)
+    columns['FATAL'] = fatal_accident[accident].astype(np.int8)
+    columns['ACCLASS'] = pd.Categorical.from_codes(columns['FATAL'].astype(np.int8),
+                                                   pd.Index(['Non-Fatal Injury', 'Fatal'], dtype=object))
+    columns['FATAL_NO'] = np.where(fatal, rng.integers(1, 70, size=n_rows), 0)
+
+    data = pd.DataFrame({column: columns[column] for column in COLUMNS})
+    return data.astype({column: dtype for column, dtype in DTYPES.items() if column not in CATEGORICAL_COLUMNS})
+
+
+def write_ksi(path, n_rows, chunk_rows=1_000_000, random_state=RSEED, distributions=None, flag_rates=None):
+    """Write ``n_rows`` synthetic rows as a KSI_CLEAN.csv lookalike, ``chunk_rows`` at a time."""
+    seeds = np.random.SeedSequence(random_state).spawn(-(-n_rows // chunk_rows))
+    accnum = 1_000_000_000
+    for number, seed in enumerate(seeds):
+        chunk = generate_ksi(min(chunk_rows, n_rows - number * chunk_rows), seed, distributions, flag_rates,
+                             first_accnum=accnum)
+        chunk.to_csv(path, mode='a' if number else 'w', header=not number, index=False)
+        accnum = int(chunk['ACCNUM'].iat[-1]) + 1
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('rows', type=int, help='number of rows')
+    parser.add_argument('output', help='CSV file to write')
+    parser.add_argument('--seed', type=int, default=RSEED, help='random seed (default: %(default)s)')
+    args = parser.parse_args(argv)
+    write_ksi(args.output, args.rows, random_state=args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Train the scoring pipeline on KSI data and save it.
+
+Fits ``ksi.pipeline.build_pipeline`` - by default the notebook's
+preprocessing and random forest, or one of the gradient boosting backends -
+on all accidents except a held out share, prints the scores on the held out
+accidents and saves the pipeline with joblib. A random forest is also saved
+in its compiled form (``ksi.compiled``) for scoring without scikit-learn.
+
+``compare_backends`` trains every backend on the same accidents and reports
+what choosing between them turns on: fit time, scoring throughput on raw
+rows, saved size and recall of every INJURY level.
+
+    python -m ksi train --input KSI_CLEAN.csv --output ksi_model.joblib
+    python -m ksi train --input KSI_CLEAN.csv --compare
+"""
+import argparse
+import importlib.util
+import io
+import time
+
+import joblib
+import pandas as pd
+
+from ksi.compiled import COMPILED_MODEL_FILE, compile_pipeline
+from ksi.data import DATA_URL, load_ksi
+from ksi.metrics import INJURY_LABELS, evaluation_report, report_table
+from ksi.pipeline import BACKENDS, MODEL_FILE, build_model, build_pipeline, encode_target, save_pipeline
+from ksi.validation import grouped_train_test_split
+
+RSEED = 42
+
+
+def available_backends():
+    """The ``BACKENDS`` whose libraries are installed."""
+    return [backend for backend in BACKENDS if backend != 'lightgbm' or importlib.util.find_spec('lightgbm')]
+
+
+def split_accidents(data, test_size=0.3, random_state=RSEED):
+    """Train and test rows of ``data`` and their encoded INJURY, with every accident on one side."""
+    y = encode_target(data)
+    return grouped_train_test_split(data, y, groups=data['ACCNUM'], stratify=y, test_size=test_size,
+                                    random_state=random_state)
+
+
+def train(data, backend='forest', test_size=0.3, n_estimators=100, n_jobs=-1, random_state=RSEED):
+    """Fit the ``backend`` pipeline on all but ``test_size`` of the accidents in ``data``.
+
+    Returns the fitted pipeline and its evaluation report (see
+    ``ksi.metrics.evaluation_report``) on the held out accidents.
+    """
+    train_data, test_data, y_train, y_test = split_accidents(data, test_size, random_state)
+    model = build_model(backend, n_estimators=n_estimators, n_jobs=n_jobs, random_state=random_state)
+    pipeline = build_pipeline(model=model, backend=backend).fit(train_data, y_train)
+    report = evaluation_report(y_test, pipeline.predict(test_data), n_resamples=0)
+    return pipeline, report
+
+
+def compare_backends(data, backends=None, test_size=0.3, n_estimators=100, n_jobs=-1, random_state=RSEED):
+    """Fit time, throughput, size and recall per class of every backend, on the same split of ``data``.
+
+    ``backends`` defaults to the installed ones. ``rows_per_second`` is
+    ``predict_proba`` on the raw test rows, preprocessing included, and
+    ``model_bytes`` the size of the pipeline saved with joblib.
+    """
+    train_data, test_data, y_train, y_test = split_accidents(data, test_size, random_state)
+    rows = []
+    for backend in backends or available_backends():
+        model = build_model(backend, n_estimators=n_estimators, n_jobs=n_jobs, random_state=random_state)
+        start = time.perf_counter()
+        pipeline = build_pipeline(model=model, backend=backend).fit(train_data, y_train)
+        fit_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        probabilities = pipeline.predict_proba(test_data)
+        predict_seconds = time.perf_counter() - start
+        buffer = io.BytesIO()
+        joblib.dump(pipeline, buffer)
+        report = evaluation_report(y_test, pipeline.classes_.take(probabilities.argmax(axis=1)), n_resamples=0)
+        rows.append({
+            'backend': backend,
+            'fit_seconds': fit_seconds,
+            'rows_per_second': len(test_data) / predict_seconds,
+            'model_bytes': buffer.getbuffer().nbytes,
+            'accuracy': report['accuracy']['value'],
+            'macro_f1': report['macro avg']['f1']['value'],
+            **{'recall %s' % name: report['classes'][name]['recall']['value'] for name in INJURY_LABELS},
+        })
+    return pd.DataFrame(rows).set_index('backend')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--input', default=DATA_URL, help='CSV file or URL of KSI rows (default: the course dataset)')
+    parser.add_argument('--backend', choices=BACKENDS, default='forest', help='model to train (default: %(default)s)')
+    parser.add_argument('--compare', action='store_true',
+                        help='train every installed backend and compare them instead of saving a model')
+    parser.add_argument('--output', default=MODEL_FILE, help='where to save the pipeline (default: %(default)s)')
+    parser.add_argument('--compiled', default=COMPILED_MODEL_FILE,
+                        help='where to save the compiled random forest (default: %(default)s)')
+    parser.add_argument('--test-size', type=float, default=0.3,
+                        help='share of the accidents held out (default: %(default)s)')
+    parser.add_argument('--n-estimators', type=int, default=100,
+                        help='trees in the forest, or boosting iterations (default: %(default)s)')
+    parser.add_argument('--n-jobs', type=int, default=-1, help='cores used by the model (default: all)')
+    args = parser.parse_args(argv)
+    data = load_ksi(args.input)
+    if args.compare:
+        print(compare_backends(data, test_size=args.test_size, n_estimators=args.n_estimators,
+                               n_jobs=args.n_jobs).to_string())
+        return
+
+    start = time.perf_counter()
+    pipeline, report = train(data, backend=args.backend, test_size=args.test_size,
+                             n_estimators=args.n_estimators, n_jobs=args.n_jobs)
+    print(report_table(report).to_string())
+    print('trained in %.1fs' % (time.perf_counter() - start))
+    save_pipeline(pipeline, args.output)
+    print('saved', args.output)
+    if args.backend == 'forest':
+        compile_pipeline(pipeline, args.compiled)
+        print('saved', args.compiled)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""Successive halving hyperparameter search for the random forest.
+
+Candidates are sampled from ``SEARCH_SPACE`` and all scored with a small
+forest; only the best third move on to the next round, where they are scored
+with three times as many trees, and so on until one candidate is left or the
+tree budget runs out. Most candidates are only ever trained with a few trees,
+so a much wider space can be searched for the cost of a few full fits.
+
+Every trial (candidate, number of trees, fold scores, fit time) is appended to
+a JSON lines file as soon as it finishes. Running the same search again with
+the same file skips the trials already in it, so an interrupted search
+resumes where it stopped. Every trial records a fingerprint of the data and
+folds it was scored on, and a file written for other data is refused rather
+than resumed.
+"""
+import json
+import math
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import ParameterSampler, StratifiedGroupKFold, StratifiedKFold, cross_val_score
+
+from ksi.validation import memmapped
+
+RSEED = 42
+
+SEARCH_SPACE = {
+    'max_depth': [5, 8, 10, 12, 16, 20, None],
+    'max_features': ['sqrt', 'log2', 0.3, 0.5, 0.8],
+    'min_samples_leaf': [1, 2, 4, 8, 16],
+    'min_samples_split': [2, 3, 5, 10],
+    'max_leaf_nodes': [None, 28, 64, 256],
+    'class_weight': [None, 'balanced', 'balanced_subsample'],
+    'bootstrap': [True, False],
+}
+
+
+def _run_trial(X, y, params, n_estimators, cv, scoring, random_state):
+    model = RandomForestClassifier(n_estimators=n_estimators, random_state=random_state, **params)
+    start = time.perf_counter()
+    scores = cross_val_score(model, X, y, cv=cv, scoring=scoring)
+    return scores, time.perf_counter() - start
+
+
+class SuccessiveHalvingSearch:
+    """Successive halving over RandomForestClassifier parameters, with trees as the budget.
+
+    After ``fit``, ``best_params_``, ``best_score_`` and ``best_estimator_``
+    (refit on all of ``X`` with ``max_estimators`` trees) follow the
+    RandomizedSearchCV attributes, and ``trials_`` holds every trial.
+    """
+
+    def __init__(self, space=SEARCH_SPACE, n_candidates=81, factor=3, min_estimators=10, max_estimators=270,
+                 cv=3, scoring='accuracy', random_state=RSEED, n_jobs=-1, trials_path=None):
+        self.space = space
+        self.n_candidates = n_candidates
+        self.factor = factor
+        self.min_estimators = min_estimators
+        self.max_estimators = max_estimators
+        self.cv = cv
+        self.scoring = scoring
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.trials_path = trials_path
+
+    def _fingerprint(self, X, y, groups, cv):
+        # Trials only carry over to the same rows, labels, folds and scoring
+        groups = None if groups is None else np.asarray(groups)
+        return '%s:%s' % ('x'.join(map(str, X.shape)), joblib.hash([X, y, groups, repr(cv), self.scoring]))
+
+    def _load_trials(self, candidates, fingerprint):
+        trials = {}
+        if not self.trials_path or not os.path.exists(self.trials_path):
+            return trials
+        with open(self.trials_path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                trial = json.loads(line)
+                if trial['candidate'] >= len(candidates) or trial['params'] != candidates[trial['candidate']]:
+                    raise ValueError('%s holds trials of a different search - use a new trials_path'
+                                     % self.trials_path)
+                if trial.get('fingerprint') != fingerprint:
+                    raise ValueError('%s holds trials scored on other data or folds - use a new trials_path'
+                                     % self.trials_path)
+                trials[trial['candidate'], trial['n_estimators']] = trial
+        return trials
+
+    def _save_trial(self, trial):
+        if self.trials_path:
+            with open(self.trials_path, 'a') as f:
+                f.write(json.dumps(trial) + '\n')
+
+    def fit(self, X, y, groups=None):
+        """Run the search; with ``groups`` (accident numbers) no accident is split across folds."""
+        # The forests work in float32, so the folds don't need a float64 copy
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        y = np.asarray(y)
+        if groups is None:
+            cv = StratifiedKFold(n_splits=self.cv, shuffle=True, random_state=self.random_state)
+        else:
+            cv = StratifiedGroupKFold(n_splits=self.cv, shuffle=True, random_state=self.random_state)
+        folds = list(cv.split(X, y, groups))
+        # Sampling is seeded, so a resumed search sees the same candidates in the same order;
+        # a JSON round trip makes them compare equal to the ones read back from the trials file
+        candidates = json.loads(json.dumps(list(
+            ParameterSampler(self.space, self.n_candidates, random_state=self.random_state))))
+        fingerprint = self._fingerprint(X, y, groups, cv)
+        trials = self._load_trials(candidates, fingerprint)
+
+        alive = list(range(len(candidates)))
+        n_estimators = self.min_estimators
+        round_number = 0
+        # The workers all read one memory-mapped copy of the data
+        with memmapped(X, y) as (X_shared, y_shared):
+            while True:
+                todo = [candidate for candidate in alive if (candidate, n_estimators) not in trials]
+                results = Parallel(n_jobs=self.n_jobs, return_as='generator')(
+                    delayed(_run_trial)(X_shared, y_shared, candidates[candidate], n_estimators, folds, self.scoring,
+                                        self.random_state)
+                    for candidate in todo)
+                for candidate, (scores, seconds) in zip(todo, results):
+                    trial = {
+                        'round': round_number,
+                        'candidate': candidate,
+                        'n_estimators': n_estimators,
+                        'params': candidates[candidate],
+                        'mean_score': float(np.mean(scores)),
+                        'std_score': float(np.std(scores)),
+                        'scores': [float(score) for score in scores],
+                        'fit_seconds': seconds,
+                        'fingerprint': fingerprint,
+                    }
+                    trials[candidate, n_estimators] = trial
+                    self._save_trial(trial)
+
+                next_estimators = n_estimators * self.factor
+                if len(alive) <= 1 or next_estimators > self.max_estimators:
+                    break
+                # Best candidates first; ties go to the earlier candidate
+                alive.sort(key=lambda candidate: -trials[candidate, n_estimators]['mean_score'])
+                alive = alive[:max(1, math.ceil(len(alive) / self.factor))]
+                n_estimators = next_estimators
+                round_number += 1
+
+        best = max(alive, key=lambda candidate: trials[candidate, n_estimators]['mean_score'])
+        self.best_params_ = candidates[best]
+        self.best_score_ = trials[best, n_estimators]['mean_score']
+        self.best_estimator_ = RandomForestClassifier(n_estimators=self.max_estimators, random_state=self.random_state,
+                                                      n_jobs=self.n_jobs, **self.best_params_).fit(X, y)
+        self.trials_ = pd.DataFrame(sorted(trials.values(), key=lambda trial: (trial['round'], trial['candidate'])))
+        return self
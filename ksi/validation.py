@@ -0,0 +1,95 @@
+"""Accident level validation, with folds run in a process pool on shared memory.
+
+One accident (``ACCNUM``) has a row per person involved, and those rows share
+the date, place, road conditions and flags. Splitting by row puts people of
+the same accident on both sides of a split, so the scores are inflated. Here
+every split keeps an accident's rows together (StratifiedGroupKFold, with the
+accident numbers as groups), while keeping the injury levels balanced.
+
+``memmapped`` dumps the matrices to a temporary folder once and hands out
+read-only memory maps of them; joblib then passes those to its worker
+processes as a file reference, so every fold reads the same pages instead of
+unpickling its own copy of the data.
+"""
+import contextlib
+import os
+import shutil
+import tempfile
+
+import joblib
+import numpy as np
+from sklearn.model_selection import StratifiedGroupKFold, cross_val_score
+from sklearn.utils import indexable
+
+RSEED = 42
+
+
+class RepeatedStratifiedGroupKFold:
+    """StratifiedGroupKFold repeated ``n_repeats`` times with different shuffles.
+
+    The grouped counterpart of RepeatedStratifiedKFold, for any sklearn
+    function taking a ``cv`` splitter and ``groups``.
+    """
+
+    def __init__(self, n_splits=10, n_repeats=3, random_state=None):
+        self.n_splits = n_splits
+        self.n_repeats = n_repeats
+        self.random_state = random_state
+
+    def split(self, X, y, groups):
+        rng = np.random.RandomState(self.random_state)
+        for _ in range(self.n_repeats):
+            folds = StratifiedGroupKFold(self.n_splits, shuffle=True, random_state=rng.randint(np.iinfo(np.int32).max))
+            yield from folds.split(X, y, groups)
+
+    def get_n_splits(self, X=None, y=None, groups=None):
+        return self.n_splits * self.n_repeats
+
+
+def grouped_train_test_split(*arrays, groups, stratify, test_size=0.3, random_state=None):
+    """``train_test_split`` that keeps every group on one side.
+
+    The test set is made of whole StratifiedGroupKFold folds, so ``test_size``
+    is rounded to the nearest 5%. Returns train and test parts of every array,
+    in the order of ``train_test_split``.
+    """
+    n_test_folds = min(19, max(1, round(test_size * 20)))
+    folds = StratifiedGroupKFold(20, shuffle=True, random_state=random_state)
+    test_mask = np.zeros(len(stratify), dtype=bool)
+    for _, (_, test) in zip(range(n_test_folds), folds.split(np.zeros(len(stratify)), stratify, groups)):
+        test_mask[test] = True
+    train, test = np.flatnonzero(~test_mask), np.flatnonzero(test_mask)
+    parts = []
+    for array in indexable(*arrays):
+        take = array.iloc if hasattr(array, 'iloc') else array
+        parts += [take[train], take[test]]
+    return parts
+
+
+@contextlib.contextmanager
+def memmapped(*arrays, folder=None):
+    """Read-only memory-mapped copies of ``arrays`` (NumPy arrays or scipy sparse matrices).
+
+    The files are deleted when the block exits.
+    """
+    folder = tempfile.mkdtemp(prefix='ksi_', dir=folder)
+    try:
+        mapped = []
+        for number, array in enumerate(arrays):
+            path = os.path.join(folder, '%d.joblib' % number)
+            joblib.dump(array, path)
+            mapped.append(joblib.load(path, mmap_mode='r'))
+        yield mapped
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def grouped_cross_val_score(model, X, y, groups, cv=None, scoring=None, n_jobs=-1):
+    """Fold scores of ``model``, keeping every accident in a single fold.
+
+    The folds run in parallel on memory-mapped copies of ``X`` and ``y``.
+    """
+    cv = cv if cv is not None else StratifiedGroupKFold(5, shuffle=True, random_state=RSEED)
+    X = X.to_numpy() if hasattr(X, 'to_numpy') else X
+    with memmapped(X, np.asarray(y)) as (X, y):
+        return cross_val_score(model, X, y, groups=groups, cv=cv, scoring=scoring, n_jobs=n_jobs)